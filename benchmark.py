@@ -0,0 +1,160 @@
+import argparse
+import http.server
+import importlib
+import json
+import logging
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+import cv2
+
+from detection.motion_detector import SimpleMotionDetector
+from lib.fps import FPS
+from presence import PresenceDetector
+from presence_lib.profiling import StageProfiler
+
+log = logging.getLogger(__name__)
+
+
+class StubArgosHandler(http.server.BaseHTTPRequestHandler):
+    # stands in for the argos /detect api with a fixed latency and response
+    protocol_version = 'HTTP/1.1'
+    latency_secs = 0
+    det_boxes = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency_secs)
+        body = json.dumps(self.det_boxes).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_argos(latency_secs, person):
+    StubArgosHandler.latency_secs = latency_secs
+    StubArgosHandler.det_boxes = [[0, 0, 50, 100, 'person', 0.9]] if person else []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubArgosHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run_benchmark(config, video_path, max_frames=None, output=False):
+    profiler = StageProfiler(keep_samples=True)
+    pd = PresenceDetector(config, None, profiler=profiler)
+    md = SimpleMotionDetector(config)
+    fps = FPS(50, 100)
+
+    if output:
+        # a video feed subscriber, so that output frames get copied and encoded
+        consumer = threading.Thread(target=lambda: [None for _ in pd.mjpeg.subscribe()])
+        consumer.daemon = True
+        consumer.start()
+
+    # frames are read in order from the file rather than through the threaded
+    # input stream, which drops or repeats frames depending on the processing speed
+    capture = cv2.VideoCapture(video_path)
+    total = 0
+    start = time.perf_counter()
+    while max_frames is None or total < max_frames:
+        t = time.perf_counter()
+        (grabbed, frame) = capture.read()
+        if not grabbed:
+            break
+        profiler.record('read', t)
+        fps.count()
+        total += 1
+        pd.process_frame(md, frame, total, fps)
+    elapsed = time.perf_counter() - start
+    capture.release()
+
+    pd.detection_worker.stop()
+    if pd.person_detector is not None:
+        pd.person_detector.close()
+    pd.mjpeg.stop()
+    pd.services.close()
+
+    stages = profiler.summary()
+    frame_stats = stages.get('frame', {})
+    return {
+        'frames': total,
+        'elapsed_secs': round(elapsed, 3),
+        'fps': round(total / elapsed, 2) if elapsed else 0,
+        'latency_ms': {
+            'p50': frame_stats.get('p50_ms'),
+            'p99': frame_stats.get('p99_ms')
+        },
+        'stages': stages,
+        'argos_service': pd.argos_client.stats() if pd.argos_client else None,
+        'argos_detection_cache': pd.detection_cache.stats(),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+if __name__ == '__main__':
+    # construct the argument parser and parse command line arguments
+    ap = argparse.ArgumentParser(description="replays a video file through the presence pipeline "
+                                             "as fast as possible and reports timings as json")
+    ap.add_argument("-c", "--config", type=str, required=True,
+                    help="path to the python config file")
+    ap.add_argument("-v", "--video", type=str, required=True,
+                    help="path to the video file to replay")
+    ap.add_argument("-n", "--frames", type=int, default=None,
+                    help="stop after this many frames")
+    ap.add_argument("-l", "--argos-latency-ms", type=float, default=100,
+                    help="latency of the stub argos service")
+    ap.add_argument("-p", "--stub-person", action='store_true',
+                    help="make the stub argos service detect a person in every image")
+    ap.add_argument("-d", "--detector", type=str, default=None, choices=['argos', 'hog'],
+                    help="person detector to use instead of the configured one")
+    ap.add_argument("-f", "--output", action='store_true',
+                    help="also produce and encode the output video feed")
+    ap.add_argument("-j", "--json", type=str, default=None,
+                    help="write the report to this file instead of stdout")
+    args = vars(ap.parse_args())
+    logging.getLogger().setLevel(logging.WARNING)
+
+    m = importlib.import_module(args["config"])
+    config = getattr(m, "Config")()
+    config.cam_name = 'benchmark'
+    config.send_mqtt = False
+    config.send_webhook = False
+    config.md_first_frame_write = False
+    config.md_idle_fps = 0
+    config.output_frame_enabled = args["output"]
+    config.video_feed_fps = 1000
+    config.config_reload_check_secs = 0
+    # the pipeline is measured with all its subsystems set up
+    config.fast_start = False
+    # the history is recorded to a throwaway folder, its cost shows in the history stage
+    config.history_path = tempfile.mkdtemp()
+    if args["detector"]:
+        config.person_detector = args["detector"]
+
+    if config.argos_person_detection_enabled and config.person_detector == 'argos':
+        stub = start_stub_argos(args["argos_latency_ms"] / 1000, args["stub_person"])
+        config.argos_service_api_url = 'http://127.0.0.1:%d/detect' % stub.server_address[1]
+        config.argos_service_batch_api_url = None
+
+    try:
+        report = run_benchmark(config, args["video"], args["frames"], args["output"])
+    finally:
+        shutil.rmtree(config.history_path, ignore_errors=True)
+    report['config'] = args["config"]
+    report['person_detector'] = config.person_detector
+    if args["json"]:
+        with open(args["json"], 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -3,6 +3,22 @@ from lib.constants import InputMode
 
 class Config:
     def __init__(self):
+        # name of the camera. when running several cameras in one process (by passing
+        # several configs) each camera is served under /<cam_name>/, e.g. /living_room/status
+        # defaults to the name of the config module
+        self.cam_name = None
+
+        # this file is checked for changes every config_reload_check_secs and reloaded without
+        # a restart (0 disables it). settings used to set up the input stream, the video feed and
+        # the argos service client only take effect after a restart
+        self.config_reload_check_secs = 5
+
+        # start the capture and the motion loop first and set up person detection, the nmask
+        # template tracker, mqtt and the webhook in the background, so that motion is detected
+        # sooner after a reboot. notifications and person detections start once they're ready.
+        # the startup milestones are logged and shown on /status and /metrics
+        self.fast_start = False
+
         # whether to show fps in the output video
         self.show_fps = True
         # whether to show current log line and presence status
@@ -58,15 +74,58 @@ class Config:
         # don't do motion detection in this mask
         self.md_nmask = None
 
+        # named zones, e.g. {'couch': (0, 120, 200, 240), 'desk': (220, 80, 320, 240)}, as boxes
+        # (minX, minY, maxX, maxY) in the coordinates of the motion detection frame. each zone has
+        # its own presence state (with the warmUp and coolDown times below), published over mqtt
+        # to <mqtt_state_topic>/<zone>. a zone has motion when at least md_zone_min_area (0 to 1)
+        # of it differs from the background by more than md_tval. zone motion is computed for all
+        # zones at once on a copy of the frame downscaled to md_zone_frame_width
+        self.md_zones = {}
+        self.md_zone_min_area = 0.02
+        self.md_zone_frame_width = 160
+
         # minimum size of the box for detected motion (useful for filtering small motion like tiny shadows or curtains moving)
         self.md_box_threshold_x = 0
         self.md_box_threshold_y = 0
 
+        # downscale frames wider than this (e.g. to 320) for motion detection and the output
+        # video feed. person detection, the nmask template tracker and motion frame snapshots
+        # still use the full resolution frame. note that md_mask and md_nmask are in the
+        # coordinates of the downscaled frame while argos_detection_nmask is in full resolution
+        self.md_frame_width = None
+
+        # while nobody is present and there has been no motion for md_idle_after_secs,
+        # motion detection is slowed down to md_idle_fps to save cpu. it goes back to full
+        # rate as soon as there is motion. set md_idle_fps to 0 to always run at full rate
+        self.md_idle_fps = 5
+        self.md_idle_after_secs = 60
+
         # if enabled will write the frame which caused presence to go ON to a file
         self.md_first_frame_write = True
 
         # folder where motion frames should be saved. they are saved as timestamped jpegs
         self.md_first_frame_write_path = "/home/pi/motion_frames"
+        # motion frames and clips are written in the background. the oldest ones are deleted
+        # once the folder holds more than this many megabytes or files
+        self.md_first_frame_write_max_mb = 500
+        self.md_first_frame_write_max_files = 1000
+
+        # save a clip of the output video around each presence transition to md_first_frame_write_path,
+        # from md_clip_pre_secs before it to md_clip_post_secs after the last transition, as a .mjpeg
+        # file (plays in ffplay or vlc). frames are kept at md_clip_fps, clips are cut at md_clip_max_secs.
+        # 0 pre and post secs disables clips, so does output_frame_enabled = False
+        self.md_clip_pre_secs = 0
+        self.md_clip_post_secs = 0
+        self.md_clip_fps = 5
+        self.md_clip_max_secs = 60
+
+        # presence, motion area, fps and person detection history, kept in <cam_name>.history in this
+        # folder for /history (None disables it). a sample is recorded every history_sample_secs, plus
+        # every presence transition and person detection. the file holds history_max_mb (~44000
+        # records per mb), then the oldest records are overwritten
+        self.history_path = "/home/pi/presence_history"
+        self.history_max_mb = 32
+        self.history_sample_secs = 1
 
         # blur the output video wherever there is motion
         # useful to share videos of argos in action or even
@@ -92,6 +151,13 @@ class Config:
         # topic where presence state changes are sent
         self.mqtt_state_topic = 'home-assistant/picam-object-presence/sensor1'
 
+        # notifications are sent in the background. a receiver gets at most one state change
+        # every notify_coalesce_secs (rapid on/off flaps are collapsed into the latest state)
+        # and failed sends are retried after notify_retry_secs, doubling up to notify_max_retry_secs
+        self.notify_coalesce_secs = 2
+        self.notify_retry_secs = 1
+        self.notify_max_retry_secs = 60
+
         # whether to enable webhook notifications to HA
         self.send_webhook = True
         # HA webhook url
@@ -128,6 +194,25 @@ class Config:
         # the argos object detection API url (could be running on the same or remote host)
         self.argos_service_api_url = 'http://<argos-host>:8080/detect'
 
+        # connect and read timeouts (seconds) for calls to the argos service
+        self.argos_service_connect_timeout_secs = 2
+        self.argos_service_read_timeout_secs = 5
+        # after this many consecutive failures, calls to the argos service are paused
+        # for argos_service_backoff_secs, doubling with every further failure
+        # up to argos_service_max_backoff_secs
+        self.argos_service_failure_threshold = 3
+        self.argos_service_backoff_secs = 5
+        self.argos_service_max_backoff_secs = 300
+
+        # optional argos compatible batch endpoint. when several cameras run in one process,
+        # detection requests arriving within argos_detection_batch_window_ms of each other
+        # are sent to it as one multipart request (one 'file' part per image and a json list
+        # of their params in a 'params' field), and it returns a json list of the boxes of each
+        # image. falls back to concurrent single requests if the service doesn't support batches
+        self.argos_service_batch_api_url = None
+        self.argos_detection_batch_window_ms = 50
+        self.argos_detection_batch_max_size = 8
+
         # the detection threshold to consider a person a person (from 0 to 1)
         # usually passed to tensorflow (if argos is configured to use tensorflow)
         self.argos_detection_threshold = 0.5
@@ -137,22 +222,100 @@ class Config:
         # alternatively you can provide an image mask. argos-presence will
         # find it in the video feed and exclude that area from detecting people
         # useful for avoiding photo frames and wall portraits to cause false alarms :)
+        # several templates can be given as a list, e.g. for several wall portraits
         self.argos_detection_nmask_template = "configs/nmask_template.jpg"
         self.argos_detection_nmask_template_update_freq_frames = 300
+        # templates are searched for within this many pixels of their last location, on an
+        # image downscaled by 2^argos_detection_nmask_template_pyramid_levels first. the full
+        # frame is only searched when the match confidence (0 to 1) drops below
+        # argos_detection_nmask_template_min_confidence
+        self.argos_detection_nmask_template_search_margin = 40
+        self.argos_detection_nmask_template_pyramid_levels = 1
+        self.argos_detection_nmask_template_min_confidence = 0.7
         self.argos_show_detection_masks = False
 
+        # person detector: 'argos' calls the argos service, 'hog' runs OpenCV's HOG people detector
+        # on this device in a worker process. hog is less accurate than the argos models but needs
+        # no argos host. it works on images downscaled to person_detector_hog_width and reports
+        # detections with an SVM weight of at least person_detector_hog_min_weight
+        self.person_detector = 'argos'
+        self.person_detector_hog_width = 400
+        self.person_detector_hog_win_stride = 8
+        self.person_detector_hog_scale = 1.05
+        self.person_detector_hog_min_weight = 0.5
+
         # this allows throttling the calls to the argos service
         # do person detections only at this frame frequency
         self.argos_detection_frequency_frames = 20
 
+        # person detection runs in the background so the motion detector never waits
+        # on the argos service. this is the maximum number of detections in flight
+        self.argos_detection_max_inflight = 1
+        # detection results which arrive later than this are stale and are dropped
+        self.argos_detection_max_result_age_secs = 5
+
+        # during coolDown, the last person found is reused instead of calling the argos service
+        # again while the scene hasn't changed: a tiny grayscale thumbnail of the frame differs by
+        # less than argos_detection_cache_threshold (mean absolute difference, 0 to 255) and the
+        # result is younger than argos_detection_cache_ttl_secs (0 disables the cache)
+        self.argos_detection_cache_ttl_secs = 60
+        self.argos_detection_cache_threshold = 4
+
+        # jpeg quality (0 to 100) of the images sent to the argos service
+        self.argos_detection_jpeg_quality = 80
+        # send only the region around the motion to the argos service instead of the
+        # full frame. during coolDown (when there is no motion) the last motion region is used.
+        # the region is padded by this fraction of its size on each side and downscaled to
+        # the input size of the detection model (e.g. 300 for ssd mobilenet)
+        self.argos_detection_crop_enabled = False
+        self.argos_detection_crop_padding = 0.25
+        self.argos_detection_input_size = 300
+
         # if you have privacy concerns about your presence camera video/image feed
         # then you can disable the output frame
         self.output_frame_enabled = True
 
+        # output frames are only produced and encoded while someone watches /video_feed
+        # or has requested /image within this many seconds
+        self.output_frame_idle_secs = 30
+        # number of preallocated output frame buffers. the video feed encoder skips a frame
+        # if it can't encode it before this many - 1 newer frames have been produced
+        self.output_frame_ring_slots = 3
+        # video feed clients beyond this many are turned away with a 503. with the aiohttp
+        # server, clients which don't take a frame within video_feed_write_timeout_secs are dropped
+        self.video_feed_max_clients = 20
+        self.video_feed_write_timeout_secs = 10
+
+        # /events streams presence transitions, log lines, fps and person detections as
+        # server-sent events. each client queues at most events_queue_size events, a slow
+        # client loses the oldest ones. /events?events=thumbnail adds a small jpeg of the
+        # output frame every events_thumbnail_secs (unless output_frame_enabled is False)
+        self.events_queue_size = 100
+        self.events_max_clients = 20
+        self.events_keepalive_secs = 15
+        self.events_thumbnail_secs = 1
+        self.events_thumbnail_width = 160
+
         # supports RTMP, picamera and local video file
         # e.g. for an rtmp stream:
         # self.input_mode = InputMode.RTMP_STREAM
         # self.rtmp_stream_url = "rtmp://192.168.1.11:43339/live/main_door"
         self.input_mode = InputMode.PI_CAM
         # make sure to set the format to bgr for the picam input mode
-        self.picam_format = "bgr"
\ No newline at end of file
+        self.picam_format = "bgr"
+
+        # capture backend for the RTMP and video file input modes: 'opencv' (the argos input
+        # streams) or 'ffmpeg'. the ffmpeg backend decodes in a separate ffmpeg process, with a
+        # hardware decoder if set (e.g. capture_ffmpeg_decoder = 'h264_v4l2m2m' on a raspberry pi)
+        # or several decoding threads (0 lets ffmpeg decide), and delivers frames already scaled
+        # to capture_width x capture_height (None keeps the source size, setting just one of
+        # them keeps the aspect ratio, smaller sources aren't scaled up). full resolution
+        # frames for person detection are delivered at capture_full_res_fps (0 to only use
+        # the scaled frames)
+        self.capture_backend = 'opencv'
+        self.capture_width = 640
+        self.capture_height = None
+        self.capture_ffmpeg_decoder = None
+        self.capture_ffmpeg_hwaccel = None
+        self.capture_ffmpeg_threads = 0
+        self.capture_full_res_fps = 2
\ No newline at end of file
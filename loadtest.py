@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import resource
+import socket
+import statistics
+import threading
+import time
+
+import aiohttp
+import cv2
+
+from benchmark import start_stub_argos
+from detection.motion_detector import SimpleMotionDetector
+from lib.fps import FPS
+from presence import PresenceDetector, start_web_server
+
+log = logging.getLogger(__name__)
+
+BOUNDARY = b'--frame\r\n'
+
+
+def replay(pd, video_path, stopped):
+    # feeds the video through the pipeline at its own frame rate, over and over
+    md = SimpleMotionDetector(pd.config)
+    fps = pd.fps = FPS(50, 100)
+    total = 0
+    while not stopped.is_set():
+        capture = cv2.VideoCapture(video_path)
+        delay = 1 / (capture.get(cv2.CAP_PROP_FPS) or 25)
+        while not stopped.is_set():
+            t = time.monotonic()
+            (grabbed, frame) = capture.read()
+            if not grabbed:
+                break
+            fps.count()
+            total += 1
+            pd.process_frame(md, frame, total, fps)
+            time.sleep(max(0, delay - (time.monotonic() - t)))
+        capture.release()
+    pd.replayed_frames = total
+
+
+async def video_feed_client(session, url, duration, read_delay):
+    # counts the jpegs received on one /video_feed connection, a read_delay makes it a slow client
+    result = {'frames': 0, 'bytes': 0, 'first_frame_ms': None, 'status': None}
+    start = time.monotonic()
+    try:
+        async with session.get(url) as response:
+            result['status'] = response.status
+            if response.status != 200:
+                return result
+            tail = b''
+            async for chunk in response.content.iter_any():
+                data = tail + chunk
+                frames = data.count(BOUNDARY)
+                if frames and result['first_frame_ms'] is None:
+                    result['first_frame_ms'] = round((time.monotonic() - start) * 1000, 1)
+                result['frames'] += frames
+                result['bytes'] += len(chunk)
+                tail = data[-len(BOUNDARY) + 1:]
+                if time.monotonic() - start > duration:
+                    break
+                if read_delay:
+                    await asyncio.sleep(read_delay)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        result['status'] = str(e)
+    result['fps'] = round(result['frames'] / duration, 2)
+    return result
+
+
+async def run_clients(url, clients, slow_clients, duration, slow_read_delay):
+    timeout = aiohttp.ClientTimeout(total=duration + 30)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        tasks = [video_feed_client(session, url, duration, slow_read_delay if i < slow_clients else 0)
+                 for i in range(clients)]
+        return await asyncio.gather(*tasks)
+
+
+def summary(results):
+    fps = [r['fps'] for r in results]
+    first_frame = [r['first_frame_ms'] for r in results if r['first_frame_ms'] is not None]
+    return {
+        'clients': len(results),
+        'fps_p50': round(statistics.median(fps), 2) if fps else None,
+        'fps_min': min(fps) if fps else None,
+        'first_frame_ms_p50': statistics.median(first_frame) if first_frame else None,
+        'megabytes': round(sum(r['bytes'] for r in results) / 1e6, 1)
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+if __name__ == '__main__':
+    # construct the argument parser and parse command line arguments
+    ap = argparse.ArgumentParser(description="replays a video file through the presence pipeline and opens "
+                                             "many concurrent /video_feed clients against the web server")
+    ap.add_argument("-c", "--config", type=str, required=True,
+                    help="path to the python config file")
+    ap.add_argument("-v", "--video", type=str, required=True,
+                    help="path to the video file to replay")
+    ap.add_argument("-s", "--server", type=str, default='aiohttp', choices=['flask', 'aiohttp'],
+                    help="web server to test")
+    ap.add_argument("-n", "--clients", type=int, default=50,
+                    help="number of concurrent video feed clients")
+    ap.add_argument("-w", "--slow-clients", type=int, default=0,
+                    help="how many of the clients read slowly")
+    ap.add_argument("-r", "--slow-read-delay-ms", type=float, default=500,
+                    help="delay between reads of the slow clients")
+    ap.add_argument("-d", "--duration", type=float, default=20,
+                    help="how long the clients stay connected, in seconds")
+    ap.add_argument("-j", "--json", type=str, default=None,
+                    help="write the report to this file instead of stdout")
+    args = vars(ap.parse_args())
+    logging.getLogger().setLevel(logging.WARNING)
+
+    m = importlib.import_module(args["config"])
+    config = getattr(m, "Config")()
+    config.cam_name = 'loadtest'
+    config.send_mqtt = False
+    config.send_webhook = False
+    config.md_first_frame_write = False
+    config.md_idle_fps = 0
+    config.config_reload_check_secs = 0
+    # the pipeline is measured with all its subsystems set up
+    config.fast_start = False
+    config.history_path = None
+    config.output_frame_enabled = True
+    config.video_feed_max_clients = max(config.video_feed_max_clients, args["clients"])
+    if config.argos_person_detection_enabled:
+        stub = start_stub_argos(0.1, False)
+        config.argos_service_api_url = 'http://127.0.0.1:%d/detect' % stub.server_address[1]
+        config.argos_service_batch_api_url = None
+
+    pd = PresenceDetector(config, None)
+    stopped = threading.Event()
+    replay_thread = threading.Thread(target=replay, args=(pd, args["video"], stopped))
+    replay_thread.daemon = True
+    replay_thread.start()
+
+    port = free_port()
+    start_web_server([pd], '127.0.0.1', port, args["server"])
+    # the flask server starts in the background
+    for _ in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    start = time.monotonic()
+    results = asyncio.run(run_clients('http://127.0.0.1:%d/video_feed' % port, args["clients"],
+                                      args["slow_clients"], args["duration"], args["slow_read_delay_ms"] / 1000))
+    threads = threading.active_count()
+    stopped.set()
+    replay_thread.join()
+    elapsed = time.monotonic() - start
+
+    slow = args["slow_clients"]
+    ok = [(i < slow, r) for i, r in enumerate(results) if r['status'] == 200]
+    report = {
+        'server': args["server"],
+        'pipeline_fps': round(pd.replayed_frames / elapsed, 2),
+        'rejected': sum(1 for r in results if r['status'] == 503),
+        'errors': sum(1 for r in results if r['status'] not in (200, 503)),
+        'clients': summary([r for is_slow, r in ok if not is_slow]),
+        'slow_clients': summary([r for is_slow, r in ok if is_slow]) if slow else None,
+        'threads': threads,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'config': args["config"]
+    }
+    pd.detection_worker.stop()
+    pd.mjpeg.stop()
+    pd.services.close()
+    if args["json"]:
+        with open(args["json"], 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -5,69 +5,229 @@ from lib.constants import InputMode
 from detection.motion_detector import SimpleMotionDetector
 from input import setup_input_stream
 
-from lib.framelimiter import FrameLimiter
-from lib.ha_webhook import HaWebHook
-from lib.task_queue import NonBlockingTaskSingleton
-
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 log = logging.getLogger(__name__)
 
 log.info("package import START")
 import argparse
 import base64
+import collections
 import datetime
 import importlib
-import io
-import json
+import os
 import threading
 import time
 
 import cv2
 import numpy
-import requests
-from flask import Flask
-from flask import Response
-from flask import jsonify
-from flask import render_template
-from flask import request
-from flask_classful import FlaskView, route
 
 from lib.fps import FPS
-from lib.ha_mqtt import HaMQTT
-from lib.timer import RepeatedTimer
+
+from presence_lib.capture import FFmpegVideoStream
+from presence_lib.config_store import ConfigStore
+from presence_lib.detection_cache import DetectionCache
+from presence_lib.detection_mask import DetectionMask, encode_nmask
+from presence_lib.detection_roi import DetectionRoi
+from presence_lib.detection_worker import DetectionWorker
+from presence_lib.history import PresenceHistory
+from presence_lib.mjpeg import MjpegBroadcaster
+from presence_lib.outbox import NotificationOutbox
+from presence_lib.presence_state import COOLDOWN, WARMUP, PresenceStateMachine
+from presence_lib.profiling import StageProfiler
+from presence_lib.recorder import MotionRecorder
+from presence_lib.scheduler import AdaptiveScheduler
+from presence_lib.services import SharedServices
+from presence_lib.startup import StartupTimer
+from presence_lib.zones import MotionZones
 
 log.info("package import END")
+# flask, requests, mqtt and the person detectors are imported when they're first needed
+IMPORTS_END = time.monotonic()
+
+
+# settings which can be changed at runtime through /config
+CONFIG_PARAMS = [
+    ('show_fps', bool), ('md_show_all_contours', bool), ('md_update_bg_model', bool), ('md_tval', int),
+    ('md_min_cont_area', int), ('md_enable_erode', bool), ('md_enable_dilate', bool),
+    ('md_erode_iterations', int), ('md_dilate_iterations', int), ('md_bg_accum_weight', float),
+    ('md_reset_bg_model', bool), ('video_feed_fps', int), ('send_mqtt', bool), ('send_webhook', bool),
+    ('fps_print_frames', int), ('mqtt_heartbeat_secs', int), ('notify_coalesce_secs', float),
+    ('presence_cooldown_secs', int), ('presence_warmup_secs', int), ('argos_person_detection_enabled', int),
+    ('argos_detection_threshold', float), ('argos_detection_frequency_frames', int), ('md_idle_fps', float),
+    ('md_idle_after_secs', int)
+]
 
 
 class PresenceDetector():
-    def __init__(self, config, camconfig):
+    def __init__(self, config, camconfig, services=None, profiler=None, config_module=None):
+        self.startup = StartupTimer(IMPORTS_END)
+        self.startup.mark('imports', IMPORTS_END)
         self.config = config
+        # the motion loop swaps in config changes between frames, see apply_config()
+        self.configs = ConfigStore(config, config_module)
         self.camconfig = camconfig
-        self.outputFrame = NonBlockingTaskSingleton()
+        self.profiler = profiler if profiler is not None else StageProfiler()
+        # detectors running in the same process share their mqtt and argos clients
+        self.owns_services = services is None
+        self.services = services if services is not None else SharedServices()
+        self.mjpeg = MjpegBroadcaster(self.video_feed_frame_rate, self.config.output_frame_idle_secs, self.profiler,
+                                      self.config.output_frame_ring_slots)
         self.current_log_line = ""
-        self.presence_status = 0
+        self.events = self.services.event_bus(self.config)
+        self.last_thumbnail = 0
+        self.presence = PresenceStateMachine(self.config, time.monotonic())
         self.presence_status_changed = False
-        self.last_motion_ts = datetime.datetime.now()
-        self.last_nonmotion_ts = datetime.datetime.now()
+        self.last_motion_box = None
+        self.motion_detected = False
+        # set by the presence state machine, the motion loop resets the motion detector's background
+        # model before the next frame (config snapshots are shared and never changed in place)
+        self.reset_bg_model = False
         self.active_video_feeds = 0
+        self.transitions = collections.Counter()
+        self.fps = None
+        self.scheduler = AdaptiveScheduler(self.config)
+        # the optional subsystems are set up by init_subsystems()
+        self.subsystems_lock = threading.Lock()
+        self.argos_client = None
+        self.person_detector = None
+        self.mqtt = None
+        self.ha_webhook = None
+        self.subsystems_ready = False
+        self.detection_cache = DetectionCache(self.config.argos_detection_cache_ttl_secs,
+                                              self.config.argos_detection_cache_threshold)
+        self.detection_worker = DetectionWorker(self.detect_person, self.config.argos_detection_max_inflight,
+                                                self.config.argos_detection_max_result_age_secs)
+        self.detection_params = {}
 
         self.stopped = False
-        if config.argos_detection_nmask_template:
-            self.nmask_detection_template = cv2.imread(config.argos_detection_nmask_template, 0)
-            self.argos_detection_nmask = None
-        elif self.config.argos_detection_nmask:
-            self.argos_detection_nmask = self.config.argos_detection_nmask
-
-        if config.send_mqtt:
-            self.mqtt = HaMQTT(self.config.mqtt_host, self.config.mqtt_port,
-                               self.config.mqtt_username, self.config.mqtt_password)
-            self.mqtt_heartbeat_timer = RepeatedTimer(self.config.mqtt_heartbeat_secs, self.mqtt_heartbeat)
-        if config.send_webhook:
+        # nmasks are in the coordinates of the (full resolution) source frame
+        self.source_scale = 1.0
+        self.vs_full_res = False
+        self.nmask_tracker = None
+        self.detection_mask = DetectionMask()
+
+        # named zones of the frame with a presence state each
+        self.zones = MotionZones(self.config, time.monotonic()) if self.config.md_zones else None
+
+        # notifications are delivered from a background outbox, which also sends the mqtt heartbeat
+        self.outbox = NotificationOutbox(self.config, self.presence_status, self.profiler)
+        self.outbox.start()
+        # motion snapshots and presence clips are written to disk in the background
+        self.recorder = MotionRecorder(self.config, self.profiler).start()
+        # presence, motion and detection history in a memory mapped file, for /history
+        self.history = None
+        if self.config.history_path:
+            path = os.path.join(self.config.history_path, '%s.history' % self.config.cam_name)
+            try:
+                self.history = PresenceHistory(path, self.config.history_max_mb, self.config.history_sample_secs)
+            except (OSError, ValueError) as e:
+                log.error("could not open the presence history %s: %s" % (path, str(e)))
+        # with fast_start, start() sets the subsystems up once the motion loop is running
+        if not self.config.fast_start:
+            self.init_subsystems()
+        self.apply_config(config)
+        self.configs.start()
+        self.startup.mark('init')
+
+    def init_subsystems(self):
+        # person detection, the nmask template tracker, mqtt and the webhook, each one only
+        # if the config enables it. until a subsystem is set up, the motion loop runs without it
+        if self.config.argos_person_detection_enabled:
+            self.init_person_detector()
+        if self.config.argos_detection_nmask_template:
+            from presence_lib.nmask_tracker import NmaskTemplateTracker
+
+            templates = self.config.argos_detection_nmask_template
+            self.nmask_tracker = NmaskTemplateTracker(
+                [templates] if isinstance(templates, str) else templates,
+                self.config.argos_detection_nmask_template_search_margin,
+                self.config.argos_detection_nmask_template_min_confidence,
+                self.config.argos_detection_nmask_template_pyramid_levels)
+        if self.config.send_mqtt:
+            self.mqtt = self.services.mqtt(self.config)
+            self.outbox.add_sink('mqtt_publish',
+                                 lambda status: self.mqtt.publish(self.config.mqtt_state_topic, status),
+                                 lambda: self.config.send_mqtt, heartbeat=True)
+            for zone in (self.zones.names if self.zones else []):
+                self.outbox.add_sink('mqtt_publish_%s' % zone,
+                                     lambda status, zone=zone: self.mqtt.publish(
+                                         '%s/%s' % (self.config.mqtt_state_topic, zone), status),
+                                     lambda: self.config.send_mqtt, heartbeat=True, key=zone)
+        if self.config.send_webhook:
+            from lib.ha_webhook import HaWebHook
+
             self.ha_webhook = HaWebHook(self.config.ha_webhook_url)
+            self.outbox.add_sink('webhook', lambda status: self.ha_webhook.send(str(status)),
+                                 lambda: self.config.send_webhook)
+        self.subsystems_ready = True
+        self.startup.mark('subsystems_ready')
+
+    def init_person_detector(self):
+        # also called when person detection is turned on through /config
+        from presence_lib.detectors import make_person_detector
+
+        with self.subsystems_lock:
+            if self.person_detector is not None:
+                return
+            if self.config.person_detector == 'argos':
+                self.argos_client = self.services.argos_client(self.config)
+            self.person_detector = make_person_detector(self.config, self.argos_client)
+
+    def init_in_background(self, init):
+        def run():
+            try:
+                init()
+            except Exception as e:
+                log.error("%s: could not initialise: %s" % (self.config.cam_name, str(e)))
+
+        thread = threading.Thread(target=run, name='init-%s' % self.config.cam_name)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def presence_status(self):
+        return self.presence.status
+
+    @property
+    def last_motion_ts(self):
+        return self.wall_clock(self.presence.last_motion)
+
+    @property
+    def last_nonmotion_ts(self):
+        return self.wall_clock(self.presence.last_nonmotion)
+
+    @staticmethod
+    def wall_clock(monotonic_ts):
+        return datetime.datetime.now() - datetime.timedelta(seconds=time.monotonic() - monotonic_ts)
+
+    def apply_config(self, config, md=None):
+        # points every component at the new config snapshot and rebuilds the state derived from it.
+        # settings used to set up the input, the output and the argos client still need a restart
+        self.config = config
+        for component in (self.presence, self.scheduler, self.outbox, self.recorder, self.person_detector):
+            if component is not None:
+                component.config = config
+        if config.argos_person_detection_enabled and self.person_detector is None and self.subsystems_ready:
+            self.init_in_background(self.init_person_detector)
+        if md is not None:
+            md.config = config
+        if self.zones:
+            self.zones.config = config
+            for state in self.zones.states.values():
+                state.config = config
+        self.detection_cache.ttl_secs = config.argos_detection_cache_ttl_secs
+        self.detection_cache.threshold = config.argos_detection_cache_threshold
+        self.detection_worker.max_result_age_secs = config.argos_detection_max_result_age_secs
+        self.recorder.start()
+        self.detection_params = {'threshold': str(config.argos_detection_threshold)}
+        nmasks = [config.argos_detection_nmask] if config.argos_detection_nmask else []
+        if not self.nmask_tracker and not self.detection_mask.same(nmasks):
+            self.detection_mask = DetectionMask(nmasks)
 
     def log(self, msg):
         log.info(msg)
         self.current_log_line = msg
+        self.events.publish('log', {'line': msg})
 
     def set_cam_config(self):
         if self.config.input_mode == InputMode.PI_CAM:
@@ -76,331 +236,480 @@ class PresenceDetector():
 
     def start(self):
         # start the pi video stream thread
-        self.vs = setup_input_stream(self.config)
+        if self.config.capture_backend == 'ffmpeg' and self.config.input_mode != InputMode.PI_CAM:
+            self.vs = FFmpegVideoStream(self.config).start()
+            self.vs_full_res = self.config.capture_full_res_fps > 0
+        else:
+            self.vs = setup_input_stream(self.config)
         self.set_cam_config()
+        self.startup.mark('capture_started')
 
         # start a thread that will perform motion detection
-        self.md_thread = threading.Thread(target=self.detect_motion)
+        self.md_thread = threading.Thread(target=self.detect_motion, name='motion-%s' % self.config.cam_name)
         self.md_thread.daemon = True
         self.md_thread.start()
+        if self.config.fast_start:
+            self.init_in_background(self.init_subsystems)
         return self.vs.t
 
     def cleanup(self):
         self.stopped = True
         self.md_thread.join()
-        if config.send_mqtt:
-            self.mqtt_heartbeat_timer.stop()
+        self.detection_worker.stop()
+        if self.person_detector is not None:
+            self.person_detector.close()
+        self.mjpeg.stop()
+        self.outbox.stop()
+        self.events.stop()
+        self.recorder.stop()
+        if self.history:
+            self.history.close()
+        self.configs.stop()
+        if self.owns_services:
+            self.services.close()
         self.vs.stop()
 
-    def mqtt_heartbeat(self):
-        self.mqtt.publish(self.config.mqtt_state_topic, self.presence_status)
-
-    def update_argos_nmask(self, frame):
-        img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    def read_source_frame(self, frame, source):
+        # the full resolution, unannotated frame: straight from the input stream if it
+        # delivers one, else the frame from before it was downscaled (or a copy of it)
+        if self.vs_full_res:
+            full_res = self.vs.read_full()
+            if full_res is not None:
+                source = full_res
+        if source is frame:
+            source = frame.copy()
+        self.source_scale = source.shape[1] / frame.shape[1]
+        return source
+
+    def draw_nmasks(self, frame):
+        self.detection_mask.draw(frame, self.source_scale)
+
+    def update_argos_nmask(self, frame, source):
         try:
-            res = cv2.matchTemplate(img, self.nmask_detection_template, cv2.TM_CCOEFF_NORMED)
+            nmasks = self.nmask_tracker.update(source)
         except Exception as e:
-            log.error("could not detect argos nmask", e)
+            log.error("could not detect argos nmask: %s" % str(e))
         else:
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-            w, h = self.nmask_detection_template.shape[::-1]
-            top_left = max_loc
-            bottom_right = (top_left[0] + w, top_left[1] + h)
-            self.argos_detection_nmask = (top_left[0]-10, top_left[1]-10, bottom_right[0]+10, bottom_right[1]+10)
-
+            # the mask is only rebuilt when the nmasks moved
+            if not self.detection_mask.same(nmasks):
+                self.detection_mask = DetectionMask(nmasks)
             if self.config.argos_show_detection_masks:
-                nminX, nminY, nmaxX, nmaxY = self.argos_detection_nmask
-                cv2.rectangle(frame, (nminX, nminY), (nmaxX, nmaxY), (128, 0, 128), 1)
-            self.log(f"argos person detection nmask: {self.argos_detection_nmask}")
-
-    def detect_person(self, frame):
-        content_type = 'image/jpeg'
-        is_success, buffer = cv2.imencode(".jpg", frame)
-        img_bytes = io.BytesIO(buffer)
+                self.draw_nmasks(frame)
+            self.log(f"argos person detection nmask: {nmasks}")
+
+    def detect_person(self, frame, roi, fingerprint=None):
+        start = time.perf_counter()
+        mask = self.detection_mask
+        detector = self.person_detector
+        image = roi.crop(frame, mask.blank_mask(frame.shape, 2 if detector.supports_nmask else 1))
+        params = dict(self.detection_params)
+        if detector.supports_nmask and mask.query is not None:
+            if roi.full:
+                params['nmask'] = mask.query
+            else:
+                nmask = roi.to_roi(mask.boxes[0])
+                if nmask:
+                    params['nmask'] = encode_nmask(nmask)
         det_boxes = None
-        url = self.config.argos_service_api_url + '?threshold=%s' % str(self.config.argos_detection_threshold)
-        if self.argos_detection_nmask:
-            if self.config.argos_show_detection_masks:
-                nminX, nminY, nmaxX, nmaxY = self.argos_detection_nmask
-                cv2.rectangle(frame, (nminX, nminY), (nmaxX, nmaxY), (128, 0, 128), 1)
-            enc_mask = base64.urlsafe_b64encode(json.dumps(self.argos_detection_nmask).encode()).decode()
-            url = url + '&nmask=%s' % enc_mask
         try:
-            det_boxes = requests.post(url, files={'file': ('presence_detector_%s' % int(time.time()),
-                                                           img_bytes, content_type)}).json()
+            det_boxes = detector.detect(image, params)
         except Exception as e:
-            log.error("Could not contact argos object detection service {}", e)
+            log.error("%s person detection failed: %s" % (detector.name, str(e)))
+
+        self.profiler.record('detection', start)
 
         if det_boxes is not None:
             if len(det_boxes) > 0:
                 for box in det_boxes:
                     minx, miny, maxx, maxy, label, accuracy = box
                     if label == 'person':
-                        log.info("argosDetector person found: %s" % str(box))
+                        box = roi.to_frame(box)
+                        log.info("%s person found: %s" % (detector.name, str(box)))
+                        if fingerprint is not None:
+                            self.detection_cache.store(fingerprint, box)
                         return box
+        if fingerprint is not None:
+            self.detection_cache.store(fingerprint, None)
         return False
 
-    def detect_presence(self, frame, motion, total_frames):
+    def person_detection_due(self, total_frames):
+        # whether detect_presence is likely to submit a person detection for this frame
+        if not self.config.argos_person_detection_enabled or self.person_detector is None \
+                or self.detection_worker.busy() or not self.person_detector.available():
+            return False
+        if self.presence_status == 0:
+            return self.presence.in_warmup(time.monotonic())
+        return total_frames % self.config.argos_detection_frequency_frames == 0
+
+    def submit_person_detection(self, kind, frame, detection_frame, box, source=None):
+        # the configured detector decides whether it's available, only the argos one is paused
+        # by the argos client's circuit breaker
+        if self.person_detector is None or not self.person_detector.available() or self.detection_worker.busy():
+            return False
+        if detection_frame is None:
+            # detection runs on the full resolution source (or a copy of the frame, since overlays
+            # keep getting drawn on it), nmasks are in source coordinates
+            detection_frame = self.read_source_frame(frame, source if source is not None else frame)
+        fingerprint = None
+        if kind == COOLDOWN and self.config.argos_detection_cache_ttl_secs > 0:
+            # reuse the last person found while the scene hasn't changed
+            fingerprint = self.detection_cache.fingerprint(detection_frame)
+            person_box = self.detection_cache.lookup(fingerprint)
+            if person_box:
+                self.detection_worker.complete(kind, person_box)
+                return True
+        roi = DetectionRoi(frame.shape, detection_frame.shape)
+        if self.config.argos_detection_crop_enabled and box is not None:
+            roi = DetectionRoi(frame.shape, detection_frame.shape, box, self.config.argos_detection_crop_padding,
+                               self.config.argos_detection_input_size)
+        if not self.detection_worker.submit(kind, detection_frame, roi, fingerprint):
+            return False
+        if self.config.argos_show_detection_masks:
+            self.draw_nmasks(frame)
+        return True
+
+    def apply_person_detections(self, now):
         person_box = None
+        for result in self.detection_worker.poll():
+            if result.box:
+                person_box = result.box
+                self.events.publish('person', {'kind': result.kind, 'box': result.box})
+                if self.zones:
+                    self.zones_changed(self.zones.on_person(result.box, now))
+                if self.presence.on_person(result.kind, now):
+                    self.log("warmUp aborted: person detected")
+                    self.presence_status_changed = True
+            if self.history:
+                # after the presence status was updated, so the detection counts for the session it started
+                self.history.on_detection(self.presence_status, result.box, result.latency_secs)
+        return person_box
+
+    def zones_changed(self, changed):
+        for zone, status in changed:
+            self.log("zone %s presenceStatus: %d" % (zone, status))
+            self.outbox.post(status, key=zone)
+            self.events.publish('zone', {'zone': zone, 'presence_status': status, 'ts': datetime.datetime.now()})
+
+    def presence_active(self):
+        # motion, warmUp and coolDown keep the motion detector at full rate
+        return self.presence.active(time.monotonic(), self.motion_detected)
+
+    def detect_presence(self, frame, motion, total_frames, detection_frame=None, source=None):
+        now = time.monotonic()
         self.presence_status_changed = False
+        self.motion_detected = motion is not None
+        # results of person detections which completed since the last frame
+        person_box = self.apply_person_detections(now)
 
         if motion is not None:
-            if self.presence_status == 0:
-                if (datetime.datetime.now() - self.last_nonmotion_ts).total_seconds() \
-                        <= self.config.presence_warmup_secs:
-                    if self.config.argos_person_detection_enabled:
-                        # do person detection here and dont reset bg (let motion come)
-                        # only activate to motion state if person found
-                        self.log("warmUp: detecting person (%d)" % (
-                                datetime.datetime.now() - self.last_nonmotion_ts).total_seconds())
-                        person_box = self.detect_person(frame)
-                        if person_box:
-                            self.log("warmUp aborted: person detected")
-                            self.presence_status = 1
-                            self.presence_status_changed = True
-                            self.log("presenceStatus: %d" % self.presence_status)
-                    else:
-                        # reset the background model to account for motion
-                        # following a status change to non motion (e.g. lighting going off)
-                        self.config.reset_bg_model = True
+            changed, detect = self.presence.on_motion(now)
+            if detect == WARMUP:
+                if self.config.argos_person_detection_enabled:
+                    # do person detection here and dont reset bg (let motion come)
+                    # only activate to motion state if person found
+                    if self.submit_person_detection(WARMUP, frame, detection_frame, motion, source):
+                        self.log("warmUp: detecting person (%d)" % (now - self.presence.last_nonmotion))
                 else:
-                    self.presence_status = 1
-                    self.presence_status_changed = True
-                    self.log("presenceStatus: %d" % self.presence_status)
-                    if self.config.md_first_frame_write:
-                        image_path = "%s/motion_frame_%s.jpg" % (
-                        self.config.md_first_frame_write_path, datetime.datetime.now().strftime("%d-%m-%Y-%H-%M-%S"))
-                        cv2.imwrite(image_path,
-                                    frame)
-            self.last_motion_ts = datetime.datetime.now()
+                    # reset the background model to account for motion
+                    # following a status change to non motion (e.g. lighting going off)
+                    self.reset_bg_model = True
+            elif changed and self.config.md_first_frame_write:
+                if detection_frame is None:
+                    detection_frame = self.read_source_frame(frame, source if source is not None else frame)
+                self.recorder.snapshot(detection_frame, datetime.datetime.now().strftime("%d-%m-%Y-%H-%M-%S"))
+            self.last_motion_box = motion
         else:
-            if self.presence_status == 1:
-                if (datetime.datetime.now() - self.last_motion_ts).total_seconds() \
-                        > self.config.presence_cooldown_secs:
-                    self.presence_status = 0
-                    self.presence_status_changed = True
-                    self.last_nonmotion_ts = datetime.datetime.now()
-                    self.log("presenceStatus: %d" % self.presence_status)
-                else:
-                    if self.config.argos_person_detection_enabled:
-                        # do person detection here
-                        # if person found, update last_motion_ts
-                        if total_frames % self.config.argos_detection_frequency_frames == 0:
-                            self.log("coolDown: detecting person (%d)" % (
-                                    datetime.datetime.now() - self.last_motion_ts).total_seconds())
-                            person_box = self.detect_person(frame)
-                            if person_box:
-                                self.last_motion_ts = datetime.datetime.now()
-
-        if self.presence_status_changed:
-            if self.config.send_mqtt:
-                self.mqtt.publish(self.config.mqtt_state_topic, self.presence_status)
-            if self.config.send_webhook:
-                self.ha_webhook.send(str(self.presence_status))
+            changed, detect = self.presence.on_no_motion(now)
+            if detect == COOLDOWN and self.config.argos_person_detection_enabled:
+                # do person detection here
+                # if person found, the coolDown is extended
+                if total_frames % self.config.argos_detection_frequency_frames == 0:
+                    if self.submit_person_detection(COOLDOWN, frame, detection_frame, self.last_motion_box,
+                                                    source):
+                        self.log("coolDown: detecting person (%d)" % (now - self.presence.last_motion))
+
+        if changed or self.presence_status_changed:
+            self.presence_status_changed = True
+            self.log("presenceStatus: %d" % self.presence_status)
+            self.startup.mark('first_presence_event')
+            self.transitions[self.presence_status] += 1
+            self.outbox.post(self.presence_status)
+            self.events.publish(*self.presence_event())
+            if self.history:
+                self.history.on_transition(self.presence_status)
+            self.recorder.transition('%s_%d' % (datetime.datetime.now().strftime("%d-%m-%Y-%H-%M-%S"),
+                                                self.presence_status))
 
         return person_box
 
     def detect_motion(self):
         # initialize the motion detector and the total number of frames
         # read thus far
-        md = SimpleMotionDetector(config)
+        md = SimpleMotionDetector(self.config)
         total = 0
 
-        fps = FPS(50, 100)
+        fps = self.fps = FPS(50, 100)
 
         # loop over frames from the video stream
         while not self.stopped:
+            # slow down while the room is empty and the scene is stable
+            self.scheduler.wait(self.presence_active())
+
             # read the next frame from the video stream, resize it,
             # convert the frame to grayscale, and blur it
+            t = time.perf_counter()
             frame = self.vs.read()
+            self.profiler.record('read', t)
+            if frame is None:
+                if getattr(self.vs, 'stopped', False):
+                    # the end of a video file, or the stream gave up
+                    log.info("input stream stopped")
+                    break
+                continue
             fps.count()
             total += 1
+            if total == 1:
+                self.startup.mark('first_frame')
+            self.process_frame(md, frame, total, fps)
+
+    def process_frame(self, md, frame, total, fps):
+        start = t = time.perf_counter()
+        config = self.configs.swap()
+        if config is not None:
+            self.apply_config(config, md)
+        # motion detection, overlays and the output work on a small frame, the full
+        # resolution source frame is only used when person detection, the nmask
+        # tracker or a snapshot need it
+        source = frame
+        if self.config.md_frame_width and frame.shape[1] > self.config.md_frame_width:
+            height = round(frame.shape[0] * self.config.md_frame_width / frame.shape[1])
+            frame = cv2.resize(frame, (self.config.md_frame_width, height), interpolation=cv2.INTER_AREA)
+            t = self.profiler.record('resize', t)
+
+        # keep the unannotated source frame if it may be sent for person detection
+        detection_frame = None
+        if self.person_detection_due(total):
+            detection_frame = self.read_source_frame(frame, source)
+        nmask_frame = None
+        if self.nmask_tracker and total % self.config.argos_detection_nmask_template_update_freq_frames == 0:
+            nmask_frame = detection_frame if detection_frame is not None else self.read_source_frame(frame, source)
+
+        # zone motion is computed before the motion detector draws on the frame
+        if self.zones:
+            changed, verify = self.zones.update(frame, time.monotonic())
+            self.zones_changed(changed)
+            if verify and self.config.argos_person_detection_enabled \
+                    and total % self.config.argos_detection_frequency_frames == 0:
+                # motion in a zone in warmUp, the result is applied to the zones it overlaps
+                self.submit_person_detection(WARMUP, frame, detection_frame, None, source)
+            t = self.profiler.record('zones', t)
+
+        # detect motion in the image
+        if self.reset_bg_model:
+            # a re-initialised motion detector learns a new background model from this frame
+            self.reset_bg_model = False
+            md.__init__(self.config)
+        (frame, crop, motion_outside) = md.detect(frame)
+        t = self.profiler.record('motion_detect', t)
+        md.show_masks(frame)
+        t = self.profiler.record('masks', t)
+        person_box = self.detect_presence(frame, crop, total, detection_frame, source)
+        t = self.profiler.record('presence', t)
+        if self.history:
+            self.history.on_frame(time.monotonic(), self.presence_status, crop, frame.shape, fps.fps)
+            t = self.profiler.record('history', t)
+        if person_box:
+            minx, miny, maxx, maxy, label, accuracy = person_box
+            text = label + ": " + str(numpy.round(accuracy, 2))
+            cv2.rectangle(frame, (minx, miny), (maxx, maxy), (0, 255, 0), 2)
+            cv2.putText(frame, text, (minx + 5, miny - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+
+        if total % self.config.fps_print_frames == 0:
+            log.info("fps: %.2f" % fps.fps)
+            self.events.publish('fps', {'fps': round(fps.fps, 2), 'md_idle': self.scheduler.idle})
+
+        # grab the current timestamp and draw it on the frame
+        if self.config.show_fps:
+            cv2.putText(frame, "%.2f fps" % fps.fps, (frame.shape[1]-50, 12),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 255), 1)
+        if self.config.show_status:
+            cv2.putText(frame, f"presence: {self.presence_status}", (5, 12),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 0), 1)
+            if self.current_log_line:
+                cv2.putText(frame, self.current_log_line, (5, frame.shape[0] - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.35, (255, 0, 0), 1)
+                self.current_log_line = ""
+        t = self.profiler.record('overlays', t)
+
+        # update argos person detection nmask
+        if nmask_frame is not None:
+            self.update_argos_nmask(frame, nmask_frame)
+            t = self.profiler.record('nmask', t)
+
+        if self.config.output_frame_enabled and self.mjpeg.wanted():
+            self.mjpeg.publish(frame)
+            t = self.profiler.record('output', t)
+        self.recorder.add_frame(frame)
+
+        if self.config.output_frame_enabled and self.events.wanted('thumbnail') and \
+                time.monotonic() - self.last_thumbnail >= self.config.events_thumbnail_secs:
+            self.publish_thumbnail(frame)
+            self.profiler.record('thumbnail', t)
+        self.profiler.record('frame', start)
+
+    def publish_thumbnail(self, frame):
+        self.last_thumbnail = time.monotonic()
+        width = self.config.events_thumbnail_width
+        if frame.shape[1] > width:
+            frame = cv2.resize(frame, (width, round(frame.shape[0] * width / frame.shape[1])),
+                               interpolation=cv2.INTER_AREA)
+        flag, jpeg = cv2.imencode(".jpg", frame)
+        if flag:
+            self.events.publish('thumbnail', {'jpeg': base64.b64encode(jpeg).decode()})
 
-            # detect motion in the image
-            (frame, crop, motion_outside) = md.detect(frame)
-            md.show_masks(frame)
-            person_box = self.detect_presence(frame, crop, total)
-            if person_box:
-                minx, miny, maxx, maxy, label, accuracy = person_box
-                text = label + ": " + str(numpy.round(accuracy, 2))
-                cv2.rectangle(frame, (minx, miny), (maxx, maxy), (0, 255, 0), 2)
-                cv2.putText(frame, text, (minx + 5, miny - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-
-            if total % self.config.fps_print_frames == 0:
-                log.info("fps: %.2f" % fps.fps)
-
-            # grab the current timestamp and draw it on the frame
-            if self.config.show_fps:
-                cv2.putText(frame, "%.2f fps" % fps.fps, (frame.shape[1]-50, 12),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 255), 1)
-            if self.config.show_status:
-                cv2.putText(frame, f"presence: {self.presence_status}", (5, 12),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 0), 1)
-                if self.current_log_line:
-                    cv2.putText(frame, self.current_log_line, (5, frame.shape[0] - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.35, (255, 0, 0), 1)
-                    self.current_log_line = ""
-
-            # update argos person detection nmask
-            if self.config.argos_detection_nmask_template:
-                if total % self.config.argos_detection_nmask_template_update_freq_frames == 0:
-                    self.update_argos_nmask(frame)
-
-            if self.config.output_frame_enabled:
-                self.outputFrame.enqueue(frame.copy())
+    def status(self):
+        return {
+            'cam_name': self.config.cam_name,
+            'active_video_feeds': self.active_video_feeds,
+            'md_idle': self.scheduler.idle,
+            'presence_status': self.presence_status,
+            'presence_status_changed': self.presence_status_changed,
+            'last_motion_ts': self.last_motion_ts,
+            'last_nonmotion_ts': self.last_nonmotion_ts,
+            'argos_detection_nmask': self.detection_mask.boxes[0] if self.detection_mask else None,
+            'argos_detection_nmasks': self.detection_mask.boxes,
+            'argos_detection_nmask_tracker': self.nmask_tracker.stats() if self.nmask_tracker else None,
+            'argos_detections_inflight': self.detection_worker.inflight,
+            'argos_detections_dropped': self.detection_worker.dropped,
+            'argos_service': self.argos_client.stats() if self.argos_client else None,
+            'argos_detection_cache': self.detection_cache.stats(),
+            'events': self.events.stats(),
+            'recorder': self.recorder.stats(),
+            'history': self.history.stats() if self.history else None,
+            'zones': self.zones.stats() if self.zones else None,
+            'notifications': self.outbox.stats(),
+            'startup': self.startup.stats()
+        }
+
+    def metrics_snapshot(self):
+        # the counters /metrics renders, as plain data which can be sent between processes
+        return {
+            'cam': self.config.cam_name,
+            'stages': {stage: (self.profiler.totals[stage], count)
+                       for stage, count in list(self.profiler.counts.items())},
+            'fps': self.fps.fps if self.fps is not None else None,
+            'presence_status': self.presence_status,
+            'zones': {zone: stats['presence_status']
+                      for zone, stats in (self.zones.stats().items() if self.zones else ())},
+            'transitions': dict(self.transitions),
+            'detections_dropped': self.detection_worker.dropped,
+            'detection_cache': self.detection_cache.stats(),
+            'startup': dict(self.startup.milestones)
+        }
+
+    def update_config(self, args):
+        # changes are made on a copy of the config, which the motion loop swaps in before its next frame
+        changes = {key: cast(args[key]) for key, cast in CONFIG_PARAMS if key in args}
+        return self.configs.update(**changes) if changes else self.config
+
+    def update_cam_config(self, args):
+        # the camconfig query params, applied to the picamera
+        if self.config.input_mode == InputMode.PI_CAM:
+            self.vs.camera.exposure_mode = args.get('exposure_mode', self.vs.camera.exposure_mode)
+            self.vs.camera.framerate = int(args.get('framerate', self.vs.camera.framerate))
+            self.vs.camera.iso = int(args.get('iso', self.vs.camera.iso))
+            self.vs.camera.meter_mode = args.get('meter_mode', self.vs.camera.meter_mode)
+
+            red, blue = self.vs.camera.awb_gains
+            red = float(args.get('awb_gains_red', red))
+            blue = float(args.get('awb_gains_blue', blue))
+            self.vs.camera.awb_gains = (red, blue)
+
+            self.vs.camera.awb_mode = args.get('awb_mode', self.vs.camera.awb_mode)
+
+            self.vs.camera.brightness = int(args.get('brightness', self.vs.camera.brightness))
+            self.vs.camera.contrast = int(args.get('contrast', self.vs.camera.contrast))
+            self.vs.camera.drc_strength = args.get('drc_strength', self.vs.camera.drc_strength)
+            self.vs.camera.exposure_compensation = int(
+                args.get('exposure_compensation', self.vs.camera.exposure_compensation))
+            self.vs.camera.image_denoise = bool(args.get('image_denoise', self.vs.camera.image_denoise))
+
+            x, y = self.vs.camera.resolution
+            x = args.get('resolution_x', x)
+            y = args.get('resolution_y', y)
+            self.vs.camera.resolution = (x, y)
+
+            self.vs.camera.saturation = int(args.get('saturation', self.vs.camera.saturation))
+            self.vs.camera.sharpness = int(args.get('sharpness', self.vs.camera.sharpness))
+            self.vs.camera.shutter_speed = int(args.get('shutter_speed', self.vs.camera.shutter_speed))
+            self.vs.camera.video_denoise = bool(args.get('video_denoise', self.vs.camera.video_denoise))
+            self.vs.camera.video_stabilization = bool(
+                args.get('video_stabilization', self.vs.camera.video_stabilization))
+
+            cam_conf = {
+                'exposure_mode': self.vs.camera.exposure_mode,
+                'framerate': float(self.vs.camera.framerate),
+                'iso': self.vs.camera.iso,
+                'meter_mode': self.vs.camera.meter_mode,
+                'analog_gain': float(self.vs.camera.analog_gain),
+                'digital_gain': float(self.vs.camera.digital_gain),
+                'awb_gains': (red, blue),
+                'awb_mode': self.vs.camera.awb_mode,
+                'brightness': self.vs.camera.brightness,
+                'contrast': self.vs.camera.contrast,
+                'drc_strength': self.vs.camera.drc_strength,
+                'exposure_compensation': self.vs.camera.exposure_compensation,
+                'exposure_speed': self.vs.camera.exposure_speed,
+                'image_denoise': self.vs.camera.image_denoise,
+                'resolution': self.vs.camera.resolution,
+                'saturation': self.vs.camera.saturation,
+                'sharpness': self.vs.camera.sharpness,
+                'shutter_speed': self.vs.camera.shutter_speed,
+                'video_denoise': self.vs.camera.video_denoise,
+                'video_stabilization': self.vs.camera.video_stabilization
+            }
+
+            return cam_conf
+        return None
+
+    def presence_event(self):
+        return 'presence', {'presence_status': self.presence_status, 'ts': datetime.datetime.now()}
+
+    def video_feed_frame_rate(self):
+        frame_rate = self.config.video_feed_fps
+        if self.config.input_mode == InputMode.PI_CAM and hasattr(self, 'vs'):
+            frame_rate = min(int(self.vs.camera.framerate), self.config.video_feed_fps)
+        return frame_rate
 
     def generate(self):
         self.active_video_feeds += 1
-        # loop over frames from the output stream
+        # loop over the jpegs encoded by the shared broadcaster
         try:
-            frame_rate = self.config.video_feed_fps
-            if self.config.input_mode == InputMode.PI_CAM:
-                frame_rate = min(int(self.vs.camera.framerate), self.config.video_feed_fps)
-            limiter = FrameLimiter(frame_rate)
-
-            while limiter.limit():
-                outputFrame = self.outputFrame.read()
-                # check if the output frame is available, otherwise skip
-                # the iteration of the loop
-                if outputFrame is None:
-                    continue
-                # encode the frame in JPEG format
-                (flag, encodedImage) = cv2.imencode(".jpg", outputFrame)
-                # ensure the frame was successfully encoded
-                if not flag:
-                    continue
+            for encodedImage in self.mjpeg.subscribe():
                 # yield the output frame in the byte format
                 yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +
-                       bytearray(encodedImage) + b'\r\n')
+                       encodedImage + b'\r\n')
         finally:
             self.active_video_feeds -= 1
 
 
-class PresenceDetectorView(FlaskView):
-    def __init__(self, presence_detector: PresenceDetector):
-        super().__init__()
-        self.pd = presence_detector
-        self.config = self.pd.config
-
-    @route("/")
-    def index(self):
-        return render_template("index.html")
-
-    @route('/status')
-    def status(self):
-        return jsonify(
-            {
-                'active_video_feeds': self.pd.active_video_feeds,
-                'presence_status': self.pd.presence_status,
-                'presence_status_changed': self.pd.presence_status_changed,
-                'last_motion_ts': self.pd.last_motion_ts,
-                'last_nonmotion_ts': self.pd.last_nonmotion_ts,
-                'argos_detection_nmask': self.pd.argos_detection_nmask
-            }
-        )
-
-    @route('/config')
-    def apiconfig(self):
-        self.config.show_fps = bool(request.args.get('show_fps', self.config.show_fps))
-        self.config.md_show_all_contours = bool(
-            request.args.get('md_show_all_contours', self.config.md_show_all_contours))
-        self.config.md_update_bg_model = bool(request.args.get('md_update_bg_model', self.config.md_update_bg_model))
-        self.config.md_tval = int(request.args.get('md_tval', self.config.md_tval))
-        self.config.md_min_cont_area = int(request.args.get('md_min_cont_area', self.config.md_min_cont_area))
-        self.config.md_enable_erode = bool(request.args.get('md_enable_erode', self.config.md_enable_erode))
-        self.config.md_enable_dilate = bool(request.args.get('md_enable_dilate', self.config.md_enable_dilate))
-        self.config.md_erode_iterations = int(request.args.get('md_erode_iterations', self.config.md_erode_iterations))
-        self.config.md_dilate_iterations = int(
-            request.args.get('md_dilate_iterations', self.config.md_dilate_iterations))
-        self.config.md_bg_accum_weight = float(request.args.get('md_bg_accum_weight', self.config.md_bg_accum_weight))
-        self.config.md_reset_bg_model = bool(request.args.get('md_reset_bg_model', self.config.md_reset_bg_model))
-        self.config.video_feed_fps = int(request.args.get('video_feed_fps', self.config.video_feed_fps))
-        self.config.send_mqtt = bool(request.args.get('send_mqtt', self.config.send_mqtt))
-        self.config.send_webhook = bool(request.args.get('send_webhook', self.config.send_webhook))
-        self.config.fps_print_frames = int(request.args.get('fps_print_frames', self.config.fps_print_frames))
-        self.config.mqtt_heartbeat_secs = int(request.args.get('mqtt_heartbeat_secs', self.config.mqtt_heartbeat_secs))
-        self.config.presence_cooldown_secs = int(
-            request.args.get('presence_cooldown_secs', self.config.presence_cooldown_secs))
-        self.config.presence_warmup_secs = int(
-            request.args.get('presence_warmup_secs', self.config.presence_warmup_secs))
-        self.config.argos_person_detection_enabled = int(
-            request.args.get('argos_person_detection_enabled', self.config.argos_person_detection_enabled))
-        self.config.argos_detection_threshold = float(
-            request.args.get('argos_detection_threshold', self.config.argos_detection_threshold))
-        self.config.argos_detection_frequency_frames = int(
-            request.args.get('argos_detection_frequency_frames', self.config.argos_detection_frequency_frames))
-
-        return jsonify(self.config.__dict__)
-
-    @route('/camconfig')
-    def camconfig(self):
-        if self.config.input_mode == InputMode.PI_CAM:
-            self.pd.vs.camera.exposure_mode = request.args.get('exposure_mode', self.pd.vs.camera.exposure_mode)
-            self.pd.vs.camera.framerate = int(request.args.get('framerate', self.pd.vs.camera.framerate))
-            self.pd.vs.camera.iso = int(request.args.get('iso', self.pd.vs.camera.iso))
-            self.pd.vs.camera.meter_mode = request.args.get('meter_mode', self.pd.vs.camera.meter_mode)
-
-            red, blue = self.pd.vs.camera.awb_gains
-            red = float(request.args.get('awb_gains_red', red))
-            blue = float(request.args.get('awb_gains_blue', blue))
-            self.pd.vs.camera.awb_gains = (red, blue)
-
-            self.pd.vs.camera.awb_mode = request.args.get('awb_mode', self.pd.vs.camera.awb_mode)
-
-            self.pd.vs.camera.brightness = int(request.args.get('brightness', self.pd.vs.camera.brightness))
-            self.pd.vs.camera.contrast = int(request.args.get('contrast', self.pd.vs.camera.contrast))
-            self.pd.vs.camera.drc_strength = request.args.get('drc_strength', self.pd.vs.camera.drc_strength)
-            self.pd.vs.camera.exposure_compensation = int(
-                request.args.get('exposure_compensation', self.pd.vs.camera.exposure_compensation))
-            self.pd.vs.camera.image_denoise = bool(request.args.get('image_denoise', self.pd.vs.camera.image_denoise))
-
-            x, y = self.pd.vs.camera.resolution
-            x = request.args.get('resolution_x', x)
-            y = request.args.get('resolution_y', y)
-            self.pd.vs.camera.resolution = (x, y)
-
-            self.pd.vs.camera.saturation = int(request.args.get('saturation', self.pd.vs.camera.saturation))
-            self.pd.vs.camera.sharpness = int(request.args.get('sharpness', self.pd.vs.camera.sharpness))
-            self.pd.vs.camera.shutter_speed = int(request.args.get('shutter_speed', self.pd.vs.camera.shutter_speed))
-            self.pd.vs.camera.video_denoise = bool(request.args.get('video_denoise', self.pd.vs.camera.video_denoise))
-            self.pd.vs.camera.video_stabilization = bool(
-                request.args.get('video_stabilization', self.pd.vs.camera.video_stabilization))
-
-            cam_conf = {
-                'exposure_mode': self.pd.vs.camera.exposure_mode,
-                'framerate': float(self.pd.vs.camera.framerate),
-                'iso': self.pd.vs.camera.iso,
-                'meter_mode': self.pd.vs.camera.meter_mode,
-                'analog_gain': float(self.pd.vs.camera.analog_gain),
-                'digital_gain': float(self.pd.vs.camera.digital_gain),
-                'awb_gains': (red, blue),
-                'awb_mode': self.pd.vs.camera.awb_mode,
-                'brightness': self.pd.vs.camera.brightness,
-                'contrast': self.pd.vs.camera.contrast,
-                'drc_strength': self.pd.vs.camera.drc_strength,
-                'exposure_compensation': self.pd.vs.camera.exposure_compensation,
-                'exposure_speed': self.pd.vs.camera.exposure_speed,
-                'image_denoise': self.pd.vs.camera.image_denoise,
-                'resolution': self.pd.vs.camera.resolution,
-                'saturation': self.pd.vs.camera.saturation,
-                'sharpness': self.pd.vs.camera.sharpness,
-                'shutter_speed': self.pd.vs.camera.shutter_speed,
-                'video_denoise': self.pd.vs.camera.video_denoise,
-                'video_stabilization': self.pd.vs.camera.video_stabilization
-            }
-
-            return jsonify(cam_conf)
+def start_web_server(presence_detectors, host, port, server='flask'):
+    # returns the server thread
+    if server == 'aiohttp':
+        from presence_lib.async_server import AsyncWebServer
+        return AsyncWebServer(presence_detectors, host, port).start()
 
-    @route("/image")
-    def image(self):
-        (flag, encodedImage) = cv2.imencode(".jpg", self.pd.outputFrame.read())
-        return Response(bytearray(encodedImage),
-                        mimetype='image/jpeg')
+    from flask import Flask
+    from presence_lib.flask_view import PresenceDetectorView
 
-    @route("/video_feed")
-    def video_feed(self):
-        return Response(self.pd.generate(),
-                        mimetype="multipart/x-mixed-replace; boundary=frame")
+    # the templates are found next to this module
+    app = Flask(__name__)
+    PresenceDetectorView.register_cameras(app, presence_detectors)
+    flask_thread = threading.Thread(target=app.run, kwargs={'host': host, 'port': port, 'debug': False,
+                                                            'threaded': True, 'use_reloader': False})
+    flask_thread.daemon = True
+    flask_thread.start()
+    return flask_thread
 
 
 if __name__ == '__main__':
@@ -410,26 +719,51 @@ if __name__ == '__main__':
                     help="ip address of the device")
     ap.add_argument("-o", "--port", type=int, required=True,
                     help="ephemeral port number of the server (1024 to 65535)")
-    ap.add_argument("-c", "--config", type=str, required=True,
-                    help="path to the python config file")
-    ap.add_argument("-y", "--camconfig", type=str, required=True,
-                    help="path to the python config file for the picamera")
+    ap.add_argument("-c", "--config", type=str, required=True, nargs='+',
+                    help="path to the python config file, one per camera")
+    ap.add_argument("-y", "--camconfig", type=str, required=True, nargs='+',
+                    help="path to the python config file for the picamera, either one per camera or one for all")
+    ap.add_argument("-s", "--server", type=str, default='flask', choices=['flask', 'aiohttp'],
+                    help="web server: flask's threaded server, or an asyncio server (needs aiohttp) "
+                         "which handles many video feed clients without a thread each")
+    ap.add_argument("-t", "--threads", action='store_true',
+                    help="with several cameras, run each one on threads of this process rather than in a "
+                         "process of its own")
     args = vars(ap.parse_args())
-
-    m = importlib.import_module(args["config"])
-    config = getattr(m, "Config")()
-    m2 = importlib.import_module(args["camconfig"])
-    camconfig = getattr(m2, "CamConfig")()
-    pd = PresenceDetector(config, camconfig)
-    cam_thread = pd.start()
-
-    # start the flask app
-    app = Flask(__name__)
-    PresenceDetectorView.register(app, init_argument=pd, route_base='/')
-    flask_thread = threading.Thread(target=app.run, kwargs={'host': args["ip"], 'port': args["port"], 'debug': False,
-                                                            'threaded': True, 'use_reloader': False})
-    flask_thread.daemon = True
-    flask_thread.start()
-
-    cam_thread.join()
-    pd.cleanup()
+    if len(args["camconfig"]) not in (1, len(args["config"])):
+        ap.error("pass either one camconfig or one per config")
+
+    # all cameras share the mqtt and argos clients and the web server. with several cameras,
+    # each one's capture, motion and presence detection runs in a process of its own so that
+    # they use separate cores, the clients and the web server stay in this process
+    services = SharedServices()
+    camera_processes = len(args["config"]) > 1 and not args["threads"]
+    presence_detectors = []
+    for i, config_name in enumerate(args["config"]):
+        m = importlib.import_module(config_name)
+        config = getattr(m, "Config")()
+        if not getattr(config, 'cam_name', None):
+            config.cam_name = config_name.split('.')[-1]
+        camconfig_name = args["camconfig"][min(i, len(args["camconfig"]) - 1)]
+        if camera_processes:
+            from presence_lib.camera_process import CameraProcess
+
+            presence_detectors.append(CameraProcess(config, camconfig_name, services, config_module=config_name))
+        else:
+            camconfig = getattr(importlib.import_module(camconfig_name), "CamConfig")()
+            presence_detectors.append(PresenceDetector(config, camconfig, services, config_module=config_name))
+    cam_threads = [pd.start() for pd in presence_detectors]
+
+    # start the web server
+    start_web_server(presence_detectors, args["ip"], args["port"], args["server"])
+    for pd in presence_detectors:
+        pd.startup.mark('web_server')
+
+    try:
+        for cam_thread in cam_threads:
+            cam_thread.join()
+    except KeyboardInterrupt:
+        log.info("interrupted, stopping")
+    for pd in presence_detectors:
+        pd.cleanup()
+    services.close()
@@ -0,0 +1,120 @@
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+
+class ArgosServiceUnavailable(Exception):
+    pass
+
+
+class ArgosBatchUnsupported(Exception):
+    pass
+
+
+class ArgosClient():
+    """
+    keep-alive, connection pooled client for the argos /detect api. consecutive
+    failures open a circuit breaker which pauses calls with exponential backoff
+    """
+
+    def __init__(self, config, pool_size=1):
+        self.config = config
+        self.session = requests.Session()
+        self.resize_pool(pool_size)
+
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.paused_until = 0
+        self.calls = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_latency = 0
+        self.total_latency = 0
+
+    def resize_pool(self, pool_size):
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def available(self):
+        return time.monotonic() >= self.paused_until
+
+    def detect(self, img_bytes, filename, params=None, content_type='image/jpeg'):
+        return self._post(self.config.argos_service_api_url, params=params,
+                          files={'file': (filename, img_bytes, content_type)})
+
+    def detect_batch(self, images, content_type='image/jpeg'):
+        # images is a list of (img_bytes, filename, params). the batch endpoint takes one
+        # 'file' part per image plus their params as a json list in the same order, and
+        # returns a json list with the detected boxes of each image
+        return self._post(self.config.argos_service_batch_api_url,
+                          files=[('file', (filename, img_bytes, content_type)) for img_bytes, filename, _ in images],
+                          data={'params': json.dumps([params for _, _, params in images])})
+
+    def _post(self, url, **kwargs):
+        if not self.available():
+            with self.lock:
+                self.skipped += 1
+            raise ArgosServiceUnavailable("argos service calls paused after %d failures" % self.consecutive_failures)
+
+        start = time.monotonic()
+        try:
+            response = self.session.post(url, timeout=(self.config.argos_service_connect_timeout_secs,
+                                                       self.config.argos_service_read_timeout_secs), **kwargs)
+            if response.status_code in (404, 405, 501) and url != self.config.argos_service_api_url:
+                raise ArgosBatchUnsupported("argos service does not support batches: %d" % response.status_code)
+            response.raise_for_status()
+            det_boxes = response.json()
+        except ArgosBatchUnsupported:
+            raise
+        except Exception:
+            self._failure(time.monotonic() - start)
+            raise
+        self._success(time.monotonic() - start)
+        return det_boxes
+
+    def _success(self, latency):
+        with self.lock:
+            self.calls += 1
+            self.last_latency = latency
+            self.total_latency += latency
+            self.consecutive_failures = 0
+            self.paused_until = 0
+
+    def _failure(self, latency):
+        with self.lock:
+            self.calls += 1
+            self.failures += 1
+            self.last_latency = latency
+            self.total_latency += latency
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.config.argos_service_failure_threshold:
+                backoff = min(self.config.argos_service_backoff_secs * 2 ** (
+                        self.consecutive_failures - self.config.argos_service_failure_threshold),
+                              self.config.argos_service_max_backoff_secs)
+                self.paused_until = time.monotonic() + backoff
+                log.warning("argos service failed %d times in a row, pausing calls for %ds" % (
+                    self.consecutive_failures, backoff))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'failures': self.failures,
+                'skipped': self.skipped,
+                'consecutive_failures': self.consecutive_failures,
+                'paused_secs': max(0, round(self.paused_until - time.monotonic(), 1)),
+                'last_latency_ms': round(self.last_latency * 1000, 1),
+                'avg_latency_ms': round(self.total_latency * 1000 / self.calls, 1) if self.calls else 0,
+                'total_latency_secs': round(self.total_latency, 6)
+            }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,213 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+
+import jinja2
+from aiohttp import web
+
+from presence_lib.events import event_names, format_event
+from presence_lib.metrics import render_metrics
+
+log = logging.getLogger(__name__)
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+json_dumps = functools.partial(json.dumps, default=str)
+
+
+class FeedHub():
+    """
+    the latest video feed jpeg of one camera, for the connections on the event loop.
+    a thread pulls the jpegs from the mjpeg broadcaster while anyone is watching and
+    wakes the connections, each of which sends the latest jpeg once it's done with
+    the previous one, so a slow connection skips frames without holding up others
+    """
+
+    def __init__(self, pd, loop):
+        self.pd = pd
+        self.loop = loop
+        self.jpeg = None
+        self.seq = 0
+        self.new_jpeg = asyncio.Event()
+        self.viewers = 0
+        self.watching = threading.Event()
+        self.thread = threading.Thread(target=self.pump, name='feed-hub-%s' % pd.config.cam_name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add_viewer(self):
+        self.viewers += 1
+        self.watching.set()
+
+    def remove_viewer(self):
+        self.viewers -= 1
+        if not self.viewers:
+            self.watching.clear()
+
+    def pump(self):
+        while not self.pd.mjpeg.stopped:
+            if not self.watching.wait(timeout=1):
+                continue
+            for jpeg in self.pd.mjpeg.subscribe():
+                self.loop.call_soon_threadsafe(self.publish, jpeg)
+                if not self.watching.is_set():
+                    break
+
+    def publish(self, jpeg):
+        self.jpeg = jpeg
+        self.seq += 1
+        new_jpeg, self.new_jpeg = self.new_jpeg, asyncio.Event()
+        new_jpeg.set()
+
+
+class AsyncWebServer():
+    """
+    serves the same api as PresenceDetectorView on an asyncio (aiohttp) server, where
+    video feed and event stream clients cost a coroutine rather than a thread. each
+    camera accepts at most video_feed_max_clients video feeds and events_max_clients
+    event streams, and connections which don't take a write within
+    video_feed_write_timeout_secs are closed
+    """
+
+    def __init__(self, presence_detectors, host, port):
+        self.presence_detectors = presence_detectors
+        self.host = host
+        self.port = port
+        self.templates = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATES_PATH), autoescape=True)
+        self.hubs = {}
+        self.loop = None
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='async-web-server')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        self.started.wait()
+        return self.thread
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def app(self):
+        app = web.Application()
+        # the first camera is served at / and, with several cameras, each one at /<cam_name>/
+        cameras = [('/', self.presence_detectors[0], self.presence_detectors)]
+        if len(self.presence_detectors) > 1:
+            cameras += [('/%s/' % pd.config.cam_name, pd, [pd]) for pd in self.presence_detectors]
+        for prefix, pd, pds in cameras:
+            app.router.add_get(prefix, functools.partial(self.index, pd, prefix))
+            app.router.add_get(prefix + 'status', functools.partial(self.status, pd))
+            app.router.add_get(prefix + 'metrics', functools.partial(self.metrics, pds))
+            app.router.add_get(prefix + 'config', functools.partial(self.apiconfig, pd))
+            app.router.add_get(prefix + 'camconfig', functools.partial(self.camconfig, pd))
+            app.router.add_get(prefix + 'image', functools.partial(self.image, pd))
+            app.router.add_get(prefix + 'events', functools.partial(self.events, pd))
+            app.router.add_get(prefix + 'history', functools.partial(self.history, pd))
+            app.router.add_get(prefix + 'video_feed', functools.partial(self.video_feed, pd))
+        return app
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.hubs = {pd: FeedHub(pd, self.loop) for pd in self.presence_detectors}
+        runner = web.AppRunner(self.app(), handle_signals=False, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.host, self.port)
+        await site.start()
+        self.port = runner.addresses[0][1]
+        log.info("serving on %s:%s" % (self.host, self.port))
+        self.started.set()
+        await asyncio.Event().wait()
+
+    async def index(self, pd, prefix, request):
+        html = self.templates.get_template("index.html").render(cam_name=pd.config.cam_name,
+                                                                 video_feed_url=prefix + 'video_feed')
+        return web.Response(text=html, content_type='text/html')
+
+    async def status(self, pd, request):
+        return web.json_response(pd.status(), dumps=json_dumps)
+
+    async def metrics(self, pds, request):
+        return web.Response(body=render_metrics(pds).encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+    async def apiconfig(self, pd, request):
+        return web.json_response(pd.update_config(request.query).__dict__, dumps=json_dumps)
+
+    async def camconfig(self, pd, request):
+        cam_conf = pd.update_cam_config(request.query)
+        if cam_conf is None:
+            return web.Response(status=404)
+        return web.json_response(cam_conf, dumps=json_dumps)
+
+    async def image(self, pd, request):
+        # waits on the encoder thread when the feed was idle
+        jpeg = await self.loop.run_in_executor(None, pd.mjpeg.image)
+        if jpeg is None:
+            return web.Response(status=503)
+        return web.Response(body=jpeg, content_type='image/jpeg')
+
+    async def history(self, pd, request):
+        if pd.history is None:
+            return web.Response(status=404)
+        try:
+            # the queries copy the whole file, so they run off the event loop
+            result = await self.loop.run_in_executor(None, pd.history.query, request.query)
+        except ValueError as e:
+            return web.Response(text=str(e), status=400)
+        return web.json_response(result, dumps=json_dumps)
+
+    async def write(self, pd, response, data):
+        await asyncio.wait_for(response.write(data), pd.config.video_feed_write_timeout_secs)
+
+    async def events(self, pd, request):
+        if len(pd.events.subscriptions) >= pd.config.events_max_clients:
+            return web.Response(status=503)
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                               'X-Accel-Buffering': 'no'})
+        await response.prepare(request)
+        wake = asyncio.Event()
+        sub = pd.events.add(event_names(request.query.get('events')),
+                            notify=lambda: self.loop.call_soon_threadsafe(wake.set))
+        try:
+            await self.write(pd, response, format_event(*pd.presence_event()).encode())
+            while not pd.events.stopped:
+                try:
+                    await asyncio.wait_for(wake.wait(), pd.events.keepalive_secs)
+                except asyncio.TimeoutError:
+                    await self.write(pd, response, b': keepalive\n\n')
+                    continue
+                wake.clear()
+                message = pd.events.drain(sub)
+                if message:
+                    await self.write(pd, response, message.encode())
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            pd.events.remove(sub)
+        return response
+
+    async def video_feed(self, pd, request):
+        if pd.active_video_feeds >= pd.config.video_feed_max_clients:
+            return web.Response(status=503)
+        response = web.StreamResponse(headers={'Content-Type': 'multipart/x-mixed-replace; boundary=frame'})
+        await response.prepare(request)
+        hub = self.hubs[pd]
+        pd.active_video_feeds += 1
+        hub.add_viewer()
+        seq = 0
+        try:
+            while not pd.mjpeg.stopped:
+                if hub.seq == seq:
+                    await hub.new_jpeg.wait()
+                # jpegs published while the previous write was pending are skipped
+                seq, jpeg = hub.seq, hub.jpeg
+                await self.write(pd, response, b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            pd.active_video_feeds -= 1
+            hub.remove_viewer()
+        return response
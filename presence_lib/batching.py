@@ -0,0 +1,138 @@
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+from presence_lib.argos_client import ArgosBatchUnsupported, ArgosServiceUnavailable
+
+log = logging.getLogger(__name__)
+
+
+class BatchingArgosClient():
+    """
+    gathers the detection requests of all presence detectors (and their workers)
+    arriving within a short window and sends them to the argos batch endpoint
+    as one request. falls back to concurrent single requests if the service
+    doesn't support batches
+    """
+
+    def __init__(self, client, window_secs, max_size):
+        self.client = client
+        self.window_secs = window_secs
+        self.max_size = max_size
+        self.batch_supported = True
+        self.batches = 0
+        self.batched_images = 0
+        # a batch request, or a batch request which turns out to be unsupported followed by a
+        # single request, each within the argos timeouts
+        self.timeout_secs = window_secs + 2 * (client.config.argos_service_connect_timeout_secs +
+                                               client.config.argos_service_read_timeout_secs)
+        self.requests = queue.Queue()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_size,
+                                                              thread_name_prefix='argos-batch')
+        self.thread = threading.Thread(target=self.collect, name='argos-batcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def pool_size(self):
+        return self.client.pool_size
+
+    def resize_pool(self, pool_size):
+        self.client.resize_pool(pool_size)
+
+    def available(self):
+        return self.client.available()
+
+    def detect(self, img_bytes, filename, params=None):
+        if not self.client.available():
+            raise ArgosServiceUnavailable("argos service calls paused after %d failures" %
+                                          self.client.consecutive_failures)
+        future = concurrent.futures.Future()
+        self.requests.put((img_bytes, filename, params, future))
+        try:
+            return future.result(timeout=self.timeout_secs)
+        except concurrent.futures.TimeoutError:
+            raise TimeoutError("argos batch detection timed out after %.1fs" % self.timeout_secs)
+
+    def collect(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.window_secs
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+            self.executor.submit(self.dispatch, batch)
+
+    def dispatch(self, batch):
+        try:
+            self.dispatch_batch(batch)
+        except Exception as e:
+            log.error("argos batch dispatch failed: %s" % str(e))
+            self.fail(batch, e)
+
+    @staticmethod
+    def fail(batch, e):
+        # fails the futures which aren't resolved yet, so no caller waits on them
+        for _, _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+    def dispatch_batch(self, batch):
+        if len(batch) > 1 and self.batch_supported:
+            try:
+                results = self.client.detect_batch([(img_bytes, filename, params)
+                                                    for img_bytes, filename, params, _ in batch])
+            except ArgosBatchUnsupported as e:
+                log.warning("%s, falling back to single requests" % str(e))
+                self.batch_supported = False
+            except Exception as e:
+                self.fail(batch, e)
+                return
+            else:
+                if not isinstance(results, list) or len(results) != len(batch):
+                    self.fail(batch, ValueError("argos batch reply has %s results for %d images" % (
+                        len(results) if isinstance(results, list) else 'no', len(batch))))
+                    return
+                self.batches += 1
+                self.batched_images += len(batch)
+                for (_, _, _, future), det_boxes in zip(batch, results):
+                    future.set_result(det_boxes)
+                return
+
+        for img_bytes, filename, params, future in batch[1:]:
+            self.executor.submit(self.single, img_bytes, filename, params, future)
+        self.single(*batch[0])
+
+    def single(self, img_bytes, filename, params, future):
+        try:
+            future.set_result(self.client.detect(img_bytes, filename, params))
+        except Exception as e:
+            future.set_exception(e)
+
+    def stats(self):
+        stats = self.client.stats()
+        stats.update({
+            'batch_supported': self.batch_supported,
+            'batches': self.batches,
+            'batched_images': self.batched_images
+        })
+        return stats
+
+    def close(self):
+        self.requests.put(None)
+        self.executor.shutdown(wait=False)
+        self.client.close()
@@ -0,0 +1,474 @@
+import concurrent.futures
+import importlib
+import itertools
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+from presence_lib.config_defaults import apply_defaults
+from presence_lib.events import DEFAULT_EVENTS, EventBus
+
+log = logging.getLogger(__name__)
+
+# how long the main process waits on a call to a camera process (e.g. for /status)
+CALL_TIMEOUT_SECS = 30
+# how often a camera process asks whether the argos service is available
+ARGOS_AVAILABLE_CHECK_SECS = 1
+
+
+class Channel():
+    """
+    messages and calls between the main process and a camera process over a pipe, in
+    both directions. calls are answered on a small thread pool, so a slow call (an
+    argos detection, an mqtt publish) doesn't hold up the messages behind it
+    """
+
+    def __init__(self, conn, name, handlers=None, methods=None):
+        self.conn = conn
+        self.handlers = handlers or {}
+        self.methods = methods or {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.pending = {}
+        self.closed = False
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='%s-calls' % name)
+        self.thread = threading.Thread(target=self.run, name='%s-channel' % name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def send(self, *message):
+        with self.lock:
+            self.conn.send(message)
+
+    def post(self, *message):
+        # a message nobody waits on, dropped once the other process is gone
+        try:
+            self.send(*message)
+        except (EOFError, OSError):
+            pass
+
+    def call(self, method, *args, timeout=None):
+        future = concurrent.futures.Future()
+        call_id = next(self.ids)
+        self.pending[call_id] = future
+        try:
+            if self.closed:
+                raise ConnectionError("camera process is gone")
+            self.send('call', call_id, method, args)
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise TimeoutError("%s call timed out after %ss" % (method, timeout))
+        finally:
+            self.pending.pop(call_id, None)
+
+    def run(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == 'reply':
+                _, call_id, ok, result = message
+                future = self.pending.get(call_id)
+                if future is not None:
+                    if ok:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(result)
+            elif kind == 'call':
+                try:
+                    self.executor.submit(self.answer, *message[1:])
+                except RuntimeError:
+                    # closed, nothing is answered anymore
+                    break
+            else:
+                self.handlers[kind](*message[1:])
+        self.closed = True
+        for future in list(self.pending.values()):
+            if not future.done():
+                future.set_exception(ConnectionError("camera process is gone"))
+
+    def answer(self, call_id, method, args):
+        try:
+            result, ok = self.methods[method](*args), True
+        except Exception as e:
+            result, ok = e, False
+        try:
+            self.send('reply', call_id, ok, result)
+        except (EOFError, OSError):
+            pass
+        except Exception as e:
+            # e.g. an exception which can't be pickled
+            self.send('reply', call_id, False, RuntimeError("%s failed: %s" % (method, str(e))))
+
+    def close(self):
+        self.conn.close()
+        self.executor.shutdown(wait=False)
+
+
+# the main process side
+
+
+class RemoteEventBus(EventBus):
+    """
+    the event bus of a camera process, in the main process where the /events clients
+    are. the camera process is told which events are subscribed to and only sends those
+    """
+
+    def __init__(self, channel, queue_size, keepalive_secs):
+        super().__init__(queue_size, keepalive_secs)
+        self.channel = channel
+
+    def names(self):
+        return set().union(*[sub.events for sub in self.subscriptions])
+
+    def add(self, events=DEFAULT_EVENTS, notify=None):
+        sub = super().add(events, notify)
+        self.channel.post('events', self.names())
+        return sub
+
+    def remove(self, sub):
+        super().remove(sub)
+        self.channel.post('events', self.names())
+
+
+class RemoteMjpeg():
+    """
+    the video feed of a camera process, in the main process. the camera process sends
+    its jpegs while anyone is subscribed here, /image asks it for the latest one
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.cond = threading.Condition()
+        self.jpeg = None
+        self.jpeg_seq = 0
+        self.subscribers = 0
+        self.stopped = False
+
+    def wanted(self):
+        return self.subscribers > 0
+
+    def on_jpeg(self, jpeg):
+        with self.cond:
+            self.jpeg = jpeg
+            self.jpeg_seq += 1
+            self.cond.notify_all()
+
+    def image(self):
+        return self.channel.call('image', timeout=CALL_TIMEOUT_SECS)
+
+    def subscribe(self):
+        with self.cond:
+            self.subscribers += 1
+            if self.subscribers == 1:
+                self.channel.post('feed', True)
+        seq = self.jpeg_seq
+        try:
+            while not self.stopped:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.stopped or self.jpeg_seq > seq, timeout=1)
+                    if self.jpeg_seq == seq:
+                        continue
+                    seq, jpeg = self.jpeg_seq, self.jpeg
+                yield jpeg
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+                if not self.subscribers:
+                    self.channel.post('feed', False)
+
+    def stop(self):
+        self.stopped = True
+        with self.cond:
+            self.cond.notify_all()
+
+
+class RemoteHistory():
+    def __init__(self, channel):
+        self.channel = channel
+
+    def query(self, args):
+        return self.channel.call('history_query', dict(args), timeout=CALL_TIMEOUT_SECS)
+
+
+class RemoteStartup():
+    def __init__(self, channel):
+        self.channel = channel
+
+    def mark(self, milestone):
+        self.channel.post('startup', milestone)
+
+
+class CameraProcess():
+    """
+    a presence detector running in a process of its own, so that CPU heavy cameras use
+    separate cores. the camera process runs the capture, motion and presence detection
+    (and the local person detector and webhook) of one camera. the main process keeps
+    the mqtt and argos clients shared by all cameras and the web server, for which this
+    object stands in for the PresenceDetector. presence, zone and person events and the
+    video feed come from the camera process as they happen, status, config and history
+    queries are calls to it. config file reloads happen in the camera process, config
+    settings which the main process uses (web server limits, mqtt and argos clients)
+    need a restart
+    """
+
+    def __init__(self, config, camconfig_module, services, config_module):
+        self.config = apply_defaults(config)
+        self.services = services
+        self.active_video_feeds = 0
+        self.argos_client = None
+        self.mqtt = None
+        self.lock = threading.Lock()
+        conn, self.child_conn = multiprocessing.Pipe()
+        self.channel = Channel(conn, config.cam_name, handlers={
+            'event': self.on_event,
+            'jpeg': self.on_jpeg
+        }, methods={
+            'mqtt_publish': self.mqtt_publish,
+            'argos_detect': self.argos_detect,
+            'argos_available': lambda: self.argos().available(),
+            'argos_stats': lambda: self.argos().stats()
+        })
+        self.events = RemoteEventBus(self.channel, config.events_queue_size, config.events_keepalive_secs)
+        self.mjpeg = RemoteMjpeg(self.channel)
+        self.history = RemoteHistory(self.channel) if config.history_path else None
+        self.startup = RemoteStartup(self.channel)
+        self.process = multiprocessing.get_context('spawn').Process(
+            target=run_camera, name='camera-%s' % config.cam_name,
+            args=(self.child_conn, config_module, camconfig_module, config.cam_name))
+
+    def start(self):
+        # returns the process, which ends with the camera's input stream
+        self.channel.start()
+        self.process.start()
+        self.child_conn.close()
+        return self.process
+
+    def on_event(self, event, data):
+        self.events.publish(event, data)
+
+    def on_jpeg(self, jpeg):
+        self.mjpeg.on_jpeg(jpeg)
+
+    def argos(self):
+        with self.lock:
+            if self.argos_client is None:
+                self.argos_client = self.services.argos_client(self.config)
+            return self.argos_client
+
+    def argos_detect(self, img_bytes, filename, params):
+        return self.argos().detect(img_bytes, filename, params)
+
+    def mqtt_publish(self, topic, payload):
+        with self.lock:
+            if self.mqtt is None:
+                self.mqtt = self.services.mqtt(self.config)
+        self.mqtt.publish(topic, payload)
+
+    def call(self, method, *args):
+        return self.channel.call(method, *args, timeout=CALL_TIMEOUT_SECS)
+
+    def status(self):
+        status = self.call('status')
+        status['active_video_feeds'] = self.active_video_feeds
+        status['events'] = self.events.stats()
+        return status
+
+    def metrics_snapshot(self):
+        return self.call('metrics_snapshot')
+
+    def update_config(self, args):
+        self.config = self.call('update_config', dict(args))
+        return self.config
+
+    def update_cam_config(self, args):
+        return self.call('update_cam_config', dict(args))
+
+    def presence_event(self):
+        return self.call('presence_event')
+
+    def generate(self):
+        self.active_video_feeds += 1
+        try:
+            for encodedImage in self.mjpeg.subscribe():
+                yield (b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' +
+                       encodedImage + b'\r\n')
+        finally:
+            self.active_video_feeds -= 1
+
+    def cleanup(self):
+        if self.process.is_alive():
+            self.channel.post('stop')
+            self.process.join(CALL_TIMEOUT_SECS)
+            if self.process.is_alive():
+                log.error("camera %s didn't stop, terminating it" % self.config.cam_name)
+                self.process.terminate()
+        self.mjpeg.stop()
+        self.events.stop()
+        self.channel.close()
+
+
+# the camera process side
+
+
+class ForwardingEventBus():
+    """
+    the event bus of a presence detector in a camera process: the events which are
+    subscribed to in the main process are sent there
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.subscribed = set()
+        self.stopped = False
+
+    def wanted(self, event):
+        return event in self.subscribed
+
+    def publish(self, event, data):
+        if event in self.subscribed and not self.stopped:
+            self.channel.post('event', event, data)
+
+    def stats(self):
+        return {}
+
+    def stop(self):
+        self.stopped = True
+
+
+class ArgosClientProxy():
+    """
+    the main process' argos client, as seen from a camera process. its availability is
+    asked for at most every ARGOS_AVAILABLE_CHECK_SECS
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.is_available = True
+        self.checked = 0
+
+    def available(self):
+        now = time.monotonic()
+        if now - self.checked >= ARGOS_AVAILABLE_CHECK_SECS:
+            self.checked = now
+            try:
+                self.is_available = self.channel.call('argos_available', timeout=ARGOS_AVAILABLE_CHECK_SECS)
+            except (ConnectionError, TimeoutError):
+                self.is_available = False
+        return self.is_available
+
+    def detect(self, img_bytes, filename, params=None):
+        return self.channel.call('argos_detect', img_bytes, filename, params)
+
+    def stats(self):
+        return self.channel.call('argos_stats', timeout=CALL_TIMEOUT_SECS)
+
+    def close(self):
+        pass
+
+
+class MqttProxy():
+    def __init__(self, channel):
+        self.channel = channel
+
+    def publish(self, topic, payload):
+        self.channel.call('mqtt_publish', topic, payload)
+
+
+class ProcessServices():
+    """
+    stands in for SharedServices in a camera process, mqtt and argos calls are made by
+    the main process
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.events = ForwardingEventBus(channel)
+        self.argos = ArgosClientProxy(channel)
+
+    def event_bus(self, config):
+        return self.events
+
+    def mqtt(self, config):
+        return MqttProxy(self.channel)
+
+    def argos_client(self, config):
+        return self.argos
+
+    def close(self):
+        pass
+
+
+def run_camera(conn, config_module, camconfig_module, cam_name):
+    # the camera process. ctrl-c is left to the main process, which stops the camera
+    # processes, or closes their pipes when it's interrupted itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from presence import PresenceDetector
+
+    config = importlib.import_module(config_module).Config()
+    config.cam_name = cam_name
+    camconfig = importlib.import_module(camconfig_module).CamConfig()
+
+    stop = threading.Event()
+    feed = threading.Event()
+    channel = Channel(conn, cam_name)
+    services = ProcessServices(channel)
+    pd = PresenceDetector(config, camconfig, services, config_module=config_module)
+
+    def set_events(names):
+        services.events.subscribed = names
+
+    def set_feed(on):
+        if on:
+            feed.set()
+        else:
+            feed.clear()
+
+    def pump_feed():
+        while not stop.is_set():
+            if not feed.wait(timeout=1):
+                continue
+            for jpeg in pd.mjpeg.subscribe():
+                channel.post('jpeg', jpeg)
+                if not feed.is_set() or stop.is_set():
+                    break
+
+    def history_query(args):
+        if pd.history is None:
+            raise ValueError("the presence history of %s is disabled" % cam_name)
+        return pd.history.query(args)
+
+    channel.handlers.update({
+        'events': set_events,
+        'feed': set_feed,
+        'startup': pd.startup.mark,
+        'stop': lambda: stop.set()
+    })
+    channel.methods.update({
+        'status': pd.status,
+        'metrics_snapshot': pd.metrics_snapshot,
+        'update_config': pd.update_config,
+        'update_cam_config': pd.update_cam_config,
+        'presence_event': pd.presence_event,
+        'image': pd.mjpeg.image,
+        'history_query': history_query
+    })
+    channel.start()
+    pump = threading.Thread(target=pump_feed, name='feed-pump')
+    pump.daemon = True
+    pump.start()
+
+    cam_thread = pd.start()
+    # runs until the input stream ends, the main process stops it or goes away
+    while cam_thread.is_alive() and not stop.wait(timeout=1) and not channel.closed:
+        pass
+    stop.set()
+    pd.cleanup()
+    channel.close()
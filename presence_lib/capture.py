@@ -0,0 +1,152 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+
+import numpy
+
+from lib.constants import InputMode
+from presence_lib.frame_ring import FrameRing
+
+log = logging.getLogger(__name__)
+
+
+def probe_size(url):
+    out = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                          'stream=width,height', '-of', 'csv=p=0', url],
+                         stdout=subprocess.PIPE, check=True, timeout=30).stdout.decode()
+    width, height = out.strip().splitlines()[0].split(',')[:2]
+    return int(width), int(height)
+
+
+def scaled_size(source_size, width, height):
+    # keeps the aspect ratio when only one side is given, sizes are kept even for the scaler
+    sw, sh = source_size
+    if width and not height:
+        height = sh * width / sw
+    elif height and not width:
+        width = sw * height / sh
+    elif not width and not height:
+        width, height = sw, sh
+    # never scales up, a source smaller than the capture size is kept at its own size
+    scale = min(1, sw / width, sh / height)
+    return int(width * scale) // 2 * 2, int(height * scale) // 2 * 2
+
+
+class FFmpegVideoStream():
+    """
+    decodes RTMP streams and video files in an ffmpeg subprocess, which can use a
+    hardware (e.g. V4L2-M2M) or multi-threaded decoder and scales the frames down
+    to the motion detection resolution before they ever reach python. frames are
+    handed over through a preallocated frame ring. full resolution frames for
+    person detection come through a second pipe at a low rate and are only copied
+    out when read_full() is called
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.url = config.rtmp_stream_url if config.input_mode == InputMode.RTMP_STREAM else config.video_file_path
+        self.full_size = probe_size(self.url)
+        self.size = scaled_size(self.full_size, config.capture_width, config.capture_height)
+        self.frames = FrameRing(3)
+        self.full_frames = FrameRing(3)
+        self.cond = threading.Condition()
+        self.last_read_seq = 0
+        self.process = None
+        self.stopped = False
+        self.t = threading.Thread(target=self.update, name='ffmpeg-capture')
+        self.t.daemon = True
+
+    def start(self):
+        self.t.start()
+        return self
+
+    def command(self, full_res_fd):
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin']
+        if self.config.capture_ffmpeg_hwaccel:
+            cmd += ['-hwaccel', self.config.capture_ffmpeg_hwaccel]
+        if self.config.capture_ffmpeg_decoder:
+            cmd += ['-c:v', self.config.capture_ffmpeg_decoder]
+        cmd += ['-threads', str(self.config.capture_ffmpeg_threads)]
+        if self.config.input_mode != InputMode.RTMP_STREAM:
+            # play files at their native frame rate, like a live stream
+            cmd += ['-re']
+        cmd += ['-i', self.url]
+
+        scale = 'scale=%d:%d' % self.size
+        if full_res_fd is None:
+            cmd += ['-an', '-vf', scale, '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+        else:
+            cmd += ['-an', '-filter_complex', '[0:v]split=2[a][b];[a]%s[low];[b]fps=%s[full]' % (
+                scale, self.config.capture_full_res_fps),
+                    '-map', '[low]', '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1',
+                    '-map', '[full]', '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:%d' % full_res_fd]
+        return cmd
+
+    def update(self):
+        while not self.stopped:
+            full_res_r, full_res_w = os.pipe() if self.config.capture_full_res_fps else (None, None)
+            self.process = subprocess.Popen(self.command(full_res_w), stdout=subprocess.PIPE,
+                                            pass_fds=(full_res_w,) if full_res_w else ())
+            full_res_thread = None
+            if full_res_w:
+                os.close(full_res_w)
+                full_res_thread = threading.Thread(target=self.read_pipe, name='ffmpeg-capture-full',
+                                                   args=(os.fdopen(full_res_r, 'rb'), self.full_size,
+                                                         self.full_frames))
+                full_res_thread.daemon = True
+                full_res_thread.start()
+
+            self.read_pipe(self.process.stdout, self.size, self.frames)
+            self.process.wait()
+            if full_res_thread:
+                full_res_thread.join()
+            if self.stopped or self.config.input_mode != InputMode.RTMP_STREAM:
+                break
+            log.warning("ffmpeg capture exited with %s, restarting" % self.process.returncode)
+            time.sleep(5)
+
+        self.stopped = True
+        with self.cond:
+            self.cond.notify_all()
+
+    def read_pipe(self, pipe, size, frames):
+        width, height = size
+        frame = numpy.empty((height, width, 3), numpy.uint8)
+        buffer = memoryview(frame).cast('B')
+        # reads until ffmpeg exits, stop() terminates it
+        with pipe:
+            while True:
+                read = 0
+                while read < len(buffer):
+                    n = pipe.readinto(buffer[read:])
+                    if not n:
+                        return
+                    read += n
+                frames.write(frame)
+                if frames is self.frames:
+                    with self.cond:
+                        self.cond.notify_all()
+
+    def read(self):
+        # waits (briefly) for a frame newer than the last one read, so that the motion
+        # detector doesn't process the same frame twice. None if there's none in time,
+        # or once the stream has stopped and the last frame was read
+        with self.cond:
+            self.cond.wait_for(lambda: self.stopped or self.frames.seq > self.last_read_seq, timeout=1)
+        seq, frame = self.frames.read()
+        if seq <= self.last_read_seq:
+            return None
+        self.last_read_seq = seq
+        return frame.copy()
+
+    def read_full(self):
+        seq, frame = self.full_frames.read()
+        return frame.copy() if frame is not None else None
+
+    def stop(self):
+        self.stopped = True
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+        self.t.join()
@@ -0,0 +1,82 @@
+import copy
+import logging
+
+log = logging.getLogger(__name__)
+
+# settings added after the first release, with the value a config written before them
+# gets. see configs/config_example.py for what they do. features which would change how
+# an existing setup behaves (the presence history, idle frame rates, clips, zones,
+# downscaling, the ffmpeg capture) are left off
+DEFAULTS = {
+    'cam_name': None,
+    'config_reload_check_secs': 5,
+    'fast_start': False,
+    'md_zones': {},
+    'md_zone_min_area': 0.02,
+    'md_zone_frame_width': 160,
+    'md_frame_width': None,
+    'md_idle_fps': 0,
+    'md_idle_after_secs': 60,
+    'md_first_frame_write_max_mb': 500,
+    'md_first_frame_write_max_files': 1000,
+    'md_clip_pre_secs': 0,
+    'md_clip_post_secs': 0,
+    'md_clip_fps': 5,
+    'md_clip_max_secs': 60,
+    'history_path': None,
+    'history_max_mb': 32,
+    'history_sample_secs': 1,
+    'notify_coalesce_secs': 2,
+    'notify_retry_secs': 1,
+    'notify_max_retry_secs': 60,
+    'argos_service_connect_timeout_secs': 2,
+    'argos_service_read_timeout_secs': 5,
+    'argos_service_failure_threshold': 3,
+    'argos_service_backoff_secs': 5,
+    'argos_service_max_backoff_secs': 300,
+    'argos_service_batch_api_url': None,
+    'argos_detection_batch_window_ms': 50,
+    'argos_detection_batch_max_size': 8,
+    'argos_detection_nmask_template_search_margin': 40,
+    'argos_detection_nmask_template_pyramid_levels': 1,
+    'argos_detection_nmask_template_min_confidence': 0.7,
+    'person_detector': 'argos',
+    'person_detector_hog_width': 400,
+    'person_detector_hog_win_stride': 8,
+    'person_detector_hog_scale': 1.05,
+    'person_detector_hog_min_weight': 0.5,
+    'argos_detection_max_inflight': 1,
+    'argos_detection_max_result_age_secs': 5,
+    'argos_detection_cache_ttl_secs': 60,
+    'argos_detection_cache_threshold': 4,
+    'argos_detection_jpeg_quality': 80,
+    'argos_detection_crop_enabled': False,
+    'argos_detection_crop_padding': 0.25,
+    'argos_detection_input_size': 300,
+    'output_frame_idle_secs': 30,
+    'output_frame_ring_slots': 3,
+    'video_feed_max_clients': 20,
+    'video_feed_write_timeout_secs': 10,
+    'events_queue_size': 100,
+    'events_max_clients': 20,
+    'events_keepalive_secs': 15,
+    'events_thumbnail_secs': 1,
+    'events_thumbnail_width': 160,
+    'capture_backend': 'opencv',
+    'capture_width': 640,
+    'capture_height': None,
+    'capture_ffmpeg_decoder': None,
+    'capture_ffmpeg_hwaccel': None,
+    'capture_ffmpeg_threads': 0,
+    'capture_full_res_fps': 2
+}
+
+
+def apply_defaults(config):
+    # fills in the settings an older config file doesn't have
+    missing = [key for key in DEFAULTS if not hasattr(config, key)]
+    for key in missing:
+        setattr(config, key, copy.copy(DEFAULTS[key]))
+    if missing:
+        log.info("config has no %s, using the defaults" % ', '.join(missing))
+    return config
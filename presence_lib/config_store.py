@@ -0,0 +1,97 @@
+import copy
+import importlib
+import logging
+import os
+import sys
+import threading
+
+from presence_lib.config_defaults import apply_defaults
+
+log = logging.getLogger(__name__)
+
+
+class ConfigStore():
+    """
+    holds the config snapshot the motion loop works with. the snapshot is never
+    changed in place: changes from /config or a reloaded config file are applied
+    to a copy, which the motion loop swaps in between two frames through swap(),
+    so a frame never sees a half-applied config. when module is given, the config
+    file is checked for changes every config_reload_check_secs and reloaded. settings
+    missing from an older config file get their defaults (see config_defaults)
+    """
+
+    def __init__(self, config, module=None):
+        self.current = apply_defaults(config)
+        self.pending = None
+        self.lock = threading.Lock()
+        self.version = 0
+        self.module = module
+        self.reload_check_secs = config.config_reload_check_secs
+        self.mtime = self.module_mtime()
+        self.stopped = threading.Event()
+        self.t = None
+
+    def update(self, **changes):
+        # called from other threads, returns the snapshot which will be swapped in
+        with self.lock:
+            config = copy.copy(self.pending or self.current)
+            for key, val in changes.items():
+                setattr(config, key, val)
+            self.pending = config
+        return config
+
+    def replace(self, config):
+        with self.lock:
+            self.pending = config
+
+    def swap(self):
+        # called by the motion loop once per frame, returns the new snapshot if there is one
+        if self.pending is None:
+            return None
+        with self.lock:
+            self.current, self.pending = self.pending, None
+            self.version += 1
+        return self.current
+
+    def module_mtime(self):
+        path = getattr(sys.modules.get(self.module), '__file__', None) if self.module else None
+        try:
+            return os.stat(path).st_mtime if path else None
+        except OSError:
+            return None
+
+    def reload(self):
+        m = importlib.reload(sys.modules[self.module])
+        config = apply_defaults(getattr(m, "Config")())
+        current = self.pending or self.current
+        # settings given on the command line or at startup aren't in the file, keep them
+        if not getattr(config, 'cam_name', None):
+            config.cam_name = current.cam_name
+        for key, val in vars(current).items():
+            if not hasattr(config, key):
+                setattr(config, key, val)
+        if vars(config) != vars(current):
+            self.replace(config)
+            log.info("config %s reloaded" % self.module)
+
+    def start(self):
+        if self.mtime is None or not self.reload_check_secs:
+            return self
+        self.t = threading.Thread(target=self.watch, name='config-reload')
+        self.t.daemon = True
+        self.t.start()
+        return self
+
+    def watch(self):
+        while not self.stopped.wait(self.reload_check_secs):
+            mtime = self.module_mtime()
+            if mtime is None or mtime == self.mtime:
+                continue
+            self.mtime = mtime
+            try:
+                self.reload()
+            except Exception as e:
+                log.error("config %s reload failed: %s" % (self.module, str(e)))
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,45 @@
+import time
+
+import cv2
+import numpy
+
+
+class DetectionCache():
+    """
+    keeps the last person detection result along with a cheap fingerprint of the
+    scene, a tiny grayscale thumbnail. while the scene hasn't changed by more than
+    threshold (mean absolute difference of the thumbnails, 0 to 255) and the
+    result is younger than ttl_secs, the cached result is reused instead of
+    calling the detector again
+    """
+
+    def __init__(self, ttl_secs, threshold, size=16):
+        self.ttl_secs = ttl_secs
+        self.threshold = threshold
+        self.size = size
+        self.entry = None
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, frame):
+        thumbnail = cv2.resize(frame, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        if thumbnail.ndim == 3:
+            thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+        return thumbnail.astype(numpy.int16)
+
+    def lookup(self, fingerprint):
+        entry = self.entry
+        if entry is not None:
+            cached_fingerprint, box, ts = entry
+            if time.monotonic() - ts <= self.ttl_secs and \
+                    numpy.abs(fingerprint - cached_fingerprint).mean() <= self.threshold:
+                self.hits += 1
+                return box
+        self.misses += 1
+        return None
+
+    def store(self, fingerprint, box):
+        self.entry = (fingerprint, box, time.monotonic()) if box else None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
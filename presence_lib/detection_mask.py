@@ -0,0 +1,55 @@
+import base64
+import json
+
+import cv2
+import numpy
+
+
+def encode_nmask(box):
+    # the nmask query param of the argos /detect api
+    return base64.urlsafe_b64encode(json.dumps(list(box)).encode()).decode()
+
+
+class DetectionMask():
+    """
+    the argos person detection nmasks (boxes in source frame coordinates) in the forms
+    they are used in, built once whenever the nmasks move or the config changes rather
+    than on every detection or frame: the encoded nmask query param when there is a
+    single nmask, a boolean array of the nmask areas for blanking out the nmasks the
+    detector can't be given as a param, and the rectangles drawn on the output frame
+    """
+
+    def __init__(self, boxes=()):
+        self.boxes = [tuple(int(v) for v in box[:4]) for box in boxes]
+        self.query = encode_nmask(self.boxes[0]) if len(self.boxes) == 1 else None
+        self.blank = None
+        self.rects = None
+        self.rects_scale = None
+
+    def __bool__(self):
+        return bool(self.boxes)
+
+    def same(self, boxes):
+        return self.boxes == [tuple(int(v) for v in box[:4]) for box in boxes]
+
+    def blank_mask(self, shape, min_boxes=2):
+        # argos takes a single nmask, so several are blanked out of the image instead
+        if not self.boxes or len(self.boxes) < min_boxes:
+            return None
+        blank = self.blank
+        if blank is None or blank.shape != shape[:2]:
+            blank = numpy.zeros(shape[:2], bool)
+            for nminX, nminY, nmaxX, nmaxY in self.boxes:
+                blank[max(0, nminY):nmaxY, max(0, nminX):nmaxX] = True
+            self.blank = blank
+        return blank
+
+    def draw(self, frame, source_scale=1.0):
+        # the output frame may be smaller than the source frame
+        if self.rects_scale != source_scale:
+            self.rects = [((int(nminX / source_scale), int(nminY / source_scale)),
+                           (int(nmaxX / source_scale), int(nmaxY / source_scale)))
+                          for nminX, nminY, nmaxX, nmaxY in self.boxes]
+            self.rects_scale = source_scale
+        for pt1, pt2 in self.rects:
+            cv2.rectangle(frame, pt1, pt2, (128, 0, 128), 1)
@@ -0,0 +1,65 @@
+import cv2
+
+
+class DetectionRoi():
+    """
+    region of the source image which is sent to the person detector. the motion box
+    is given in the coordinates of the frame motion detection ran on (which may be
+    smaller than the source), the region is padded, clipped to the source and
+    downscaled to the detector's input size. detections are mapped back to frame
+    coordinates with to_frame(), masks in source coordinates into the roi with to_roi()
+    """
+
+    def __init__(self, frame_shape, source_shape, box=None, padding=0, input_size=None):
+        fh, fw = frame_shape[:2]
+        sh, sw = source_shape[:2]
+        self.sx = sw / fw
+        self.sy = sh / fh
+
+        if box is None:
+            x0, y0, x1, y1 = 0, 0, sw, sh
+        else:
+            minX, minY, maxX, maxY = box[:4]
+            pad_x = (maxX - minX) * padding
+            pad_y = (maxY - minY) * padding
+            x0 = max(0, int((minX - pad_x) * self.sx))
+            y0 = max(0, int((minY - pad_y) * self.sy))
+            x1 = min(sw, int((maxX + pad_x) * self.sx))
+            y1 = min(sh, int((maxY + pad_y) * self.sy))
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+
+        self.scale = 1.0
+        if input_size and max(x1 - x0, y1 - y0) > input_size:
+            self.scale = input_size / max(x1 - x0, y1 - y0)
+        # the whole source at its own resolution, masks need no translating
+        self.full = box is None and self.scale == 1.0
+
+    def crop(self, source, blank=None):
+        roi = source[self.y0:self.y1, self.x0:self.x1]
+        if blank is not None:
+            # blanks the masked areas (a boolean array in source coordinates) before scaling, on a
+            # copy since the source frame is also used by the nmask tracker and for snapshots
+            roi = roi.copy()
+            roi[blank[self.y0:self.y1, self.x0:self.x1]] = 0
+        if self.scale < 1.0:
+            size = (max(1, round((self.x1 - self.x0) * self.scale)), max(1, round((self.y1 - self.y0) * self.scale)))
+            roi = cv2.resize(roi, size, interpolation=cv2.INTER_AREA)
+        return roi
+
+    def to_roi(self, box):
+        # translates a box in source coordinates into the roi, None if they don't overlap
+        minX, minY, maxX, maxY = box[:4]
+        x0 = max(self.x0, minX)
+        y0 = max(self.y0, minY)
+        x1 = min(self.x1, maxX)
+        y1 = min(self.y1, maxY)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (int((x0 - self.x0) * self.scale), int((y0 - self.y0) * self.scale),
+                int((x1 - self.x0) * self.scale), int((y1 - self.y0) * self.scale))
+
+    def to_frame(self, box):
+        # maps a detection box (minx, miny, maxx, maxy, label, accuracy) from the roi to frame coordinates
+        minx, miny, maxx, maxy = box[:4]
+        return [int((minx / self.scale + self.x0) / self.sx), int((miny / self.scale + self.y0) / self.sy),
+                int((maxx / self.scale + self.x0) / self.sx), int((maxy / self.scale + self.y0) / self.sy)] + list(box[4:])
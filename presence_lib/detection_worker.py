@@ -0,0 +1,82 @@
+import collections
+import concurrent.futures
+import functools
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# latency_secs is None for results which didn't need a detection
+DetectionResult = collections.namedtuple('DetectionResult', ['seq', 'kind', 'submitted_ts', 'box', 'latency_secs'])
+
+
+class DetectionWorker():
+    """
+    runs person detection off the motion detection thread. at most max_inflight
+    detections are pending at any time, completed results are handed back to
+    the caller's thread through poll(), which drops out of order and stale results
+    """
+
+    def __init__(self, detect_fn, max_inflight=1, max_result_age_secs=5):
+        self.detect_fn = detect_fn
+        self.max_inflight = max_inflight
+        self.max_result_age_secs = max_result_age_secs
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_inflight,
+                                                              thread_name_prefix='person-detection')
+        self.results = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.seq = 0
+        self.applied_seq = 0
+        self.dropped = 0
+
+    def busy(self):
+        return self.inflight >= self.max_inflight
+
+    def submit(self, kind, frame, *args):
+        with self.lock:
+            if self.inflight >= self.max_inflight:
+                return None
+            self.inflight += 1
+        self.seq += 1
+        future = self.executor.submit(self.detect_fn, frame, *args)
+        future.add_done_callback(functools.partial(self._done, self.seq, kind, time.monotonic()))
+        return future
+
+    def complete(self, kind, box):
+        # hands back a result which didn't need a detection, e.g. a cached one
+        self.seq += 1
+        self.results.put(DetectionResult(self.seq, kind, time.monotonic(), box, None))
+
+    def _done(self, seq, kind, submitted_ts, future):
+        with self.lock:
+            self.inflight -= 1
+        try:
+            box = future.result()
+        except Exception as e:
+            log.error("person detection failed: %s" % str(e))
+            box = None
+        self.results.put(DetectionResult(seq, kind, submitted_ts, box, time.monotonic() - submitted_ts))
+
+    def poll(self):
+        completed = []
+        while True:
+            try:
+                completed.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+
+        results = []
+        now = time.monotonic()
+        for result in sorted(completed, key=lambda r: r.seq):
+            if result.seq <= self.applied_seq or now - result.submitted_ts > self.max_result_age_secs:
+                self.dropped += 1
+                continue
+            self.applied_seq = result.seq
+            results.append(result)
+        return results
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
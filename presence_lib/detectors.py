@@ -0,0 +1,101 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import sys
+import time
+
+import cv2
+import numpy
+
+from presence_lib.argos_client import ArgosServiceUnavailable
+
+log = logging.getLogger(__name__)
+
+# the hog detector of a worker process, created on its first detection
+_hog = None
+
+
+class ArgosPersonDetector():
+    """
+    person detection by the argos /detect api. the image is sent as a jpeg, a single
+    nmask is passed to argos as a query param
+    """
+    name = 'argos'
+    supports_nmask = True
+
+    def __init__(self, config, client):
+        self.config = config
+        self.client = client
+
+    def available(self):
+        return self.client.available()
+
+    def detect(self, image, params):
+        is_success, buffer = cv2.imencode(".jpg", image,
+                                          [cv2.IMWRITE_JPEG_QUALITY, self.config.argos_detection_jpeg_quality])
+        try:
+            return self.client.detect(buffer.tobytes(), 'presence_detector_%s' % int(time.time()), params)
+        except ArgosServiceUnavailable as e:
+            log.debug(str(e))
+            return None
+
+    def close(self):
+        # the client is shared, the services close it
+        pass
+
+
+def hog_detect(image, win_stride, scale, min_weight):
+    # runs in the worker process
+    global _hog
+    if _hog is None:
+        _hog = cv2.HOGDescriptor()
+        _hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    if image is None:
+        return []
+    rects, weights = _hog.detectMultiScale(image, winStride=(win_stride, win_stride), scale=scale)
+    return [[int(x), int(y), int(x + w), int(y + h), 'person', float(weight)]
+            for (x, y, w, h), weight in zip(rects, numpy.ravel(weights)) if weight >= min_weight]
+
+
+class HogPersonDetector():
+    """
+    OpenCV's HOG people detector, run on this device in a worker process so that neither
+    the GIL nor the motion thread are affected. less accurate than the models argos runs,
+    but needs no argos host. images are downscaled to person_detector_hog_width first and
+    nmasks are blanked out of the image
+    """
+    name = 'hog'
+    supports_nmask = False
+
+    def __init__(self, config):
+        self.config = config
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                           mp_context=multiprocessing.get_context('spawn'))
+        # starts the worker process and builds the detector before the first detection
+        self.pool.submit(hog_detect, None, 0, 0, 0)
+
+    def available(self):
+        return True
+
+    def detect(self, image, params):
+        scale = min(1.0, self.config.person_detector_hog_width / image.shape[1])
+        if scale < 1.0:
+            image = cv2.resize(image, (self.config.person_detector_hog_width, round(image.shape[0] * scale)),
+                               interpolation=cv2.INTER_AREA)
+        boxes = self.pool.submit(hog_detect, image, self.config.person_detector_hog_win_stride,
+                                 self.config.person_detector_hog_scale,
+                                 self.config.person_detector_hog_min_weight).result()
+        return [[int(v / scale) for v in box[:4]] + box[4:] for box in boxes]
+
+    def close(self):
+        # cancel_futures needs python 3.9, the armv7 image runs 3.7
+        if sys.version_info >= (3, 9):
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            self.pool.shutdown(wait=False)
+
+
+def make_person_detector(config, argos_client):
+    if config.person_detector == 'hog':
+        return HogPersonDetector(config)
+    return ArgosPersonDetector(config, argos_client)
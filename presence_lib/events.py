@@ -0,0 +1,104 @@
+import collections
+import json
+import threading
+
+# events sent to /events subscribers unless they ask for others
+DEFAULT_EVENTS = ('presence', 'zone', 'log', 'fps', 'person')
+
+
+def event_names(events):
+    # the ?events= param of /events, comma separated
+    return events.split(',') if events else DEFAULT_EVENTS
+
+
+def format_event(event, data):
+    # a server-sent event, serialized once for all subscribers
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data, default=str))
+
+
+class EventSubscription():
+    def __init__(self, events, queue_size, notify=None):
+        self.events = set(events)
+        self.queue = collections.deque(maxlen=queue_size)
+        self.notify = notify
+        self.dropped = 0
+
+
+class EventBus():
+    """
+    pushes presence and zone transitions, log lines, fps, person detections and thumbnails
+    to the /events (server-sent events) subscribers as they happen. each subscriber
+    has a bounded queue, a slow subscriber loses its oldest events rather than
+    holding up the publisher, which never blocks. events nobody subscribed to
+    aren't serialized at all
+    """
+
+    def __init__(self, queue_size=100, keepalive_secs=15):
+        self.queue_size = queue_size
+        self.keepalive_secs = keepalive_secs
+        self.subscriptions = []
+        self.cond = threading.Condition()
+        self.stopped = False
+
+    def wanted(self, event):
+        return any(event in sub.events for sub in self.subscriptions)
+
+    def publish(self, event, data):
+        subscriptions = [sub for sub in self.subscriptions if event in sub.events]
+        if not subscriptions:
+            return
+        message = format_event(event, data)
+        with self.cond:
+            for sub in subscriptions:
+                if len(sub.queue) == sub.queue.maxlen:
+                    sub.dropped += 1
+                sub.queue.append(message)
+            self.cond.notify_all()
+        for sub in subscriptions:
+            if sub.notify:
+                sub.notify()
+
+    def add(self, events=DEFAULT_EVENTS, notify=None):
+        # notify is called on the publishing thread whenever events were queued for the subscription
+        sub = EventSubscription(events, self.queue_size, notify)
+        with self.cond:
+            self.subscriptions = self.subscriptions + [sub]
+        return sub
+
+    def remove(self, sub):
+        with self.cond:
+            self.subscriptions = [s for s in self.subscriptions if s is not sub]
+
+    def drain(self, sub):
+        with self.cond:
+            message = ''.join(sub.queue)
+            sub.queue.clear()
+        return message
+
+    def subscribe(self, events=DEFAULT_EVENTS, initial=()):
+        # yields server-sent events, starting with the initial (event, data) pairs
+        sub = self.add(events)
+        try:
+            for event, data in initial:
+                yield format_event(event, data)
+            while not self.stopped:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.stopped or sub.queue, timeout=self.keepalive_secs):
+                        message = ': keepalive\n\n'
+                    elif self.stopped:
+                        break
+                    else:
+                        message = ''.join(sub.queue)
+                        sub.queue.clear()
+                yield message
+        finally:
+            self.remove(sub)
+
+    def stats(self):
+        subscriptions = self.subscriptions
+        return {'subscribers': len(subscriptions), 'dropped': sum(sub.dropped for sub in subscriptions)}
+
+    def stop(self):
+        self.stopped = True
+        with self.cond:
+            self.cond.notify_all()
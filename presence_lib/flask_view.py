@@ -0,0 +1,84 @@
+from flask import Response
+from flask import jsonify
+from flask import render_template
+from flask import request
+from flask import url_for
+from flask_classful import FlaskView, route
+
+from presence_lib.events import event_names
+from presence_lib.metrics import render_metrics
+
+
+class PresenceDetectorView(FlaskView):
+    presence_detectors = []
+
+    def __init__(self, presence_detector):
+        super().__init__()
+        self.pd = presence_detector
+        self.config = self.pd.config
+
+    @classmethod
+    def register_cameras(cls, app, presence_detectors):
+        # the first camera is served at / and, with several cameras, each one at /<cam_name>/
+        cls.presence_detectors = presence_detectors
+        cls.register(app, init_argument=presence_detectors[0], route_base='/')
+        if len(presence_detectors) > 1:
+            for pd in presence_detectors:
+                view = type('%s_%s' % (cls.__name__, pd.config.cam_name), (cls,), {'presence_detectors': [pd]})
+                view.register(app, init_argument=pd, route_base='/%s/' % pd.config.cam_name)
+
+    @route("/")
+    def index(self):
+        return render_template("index.html", cam_name=self.config.cam_name,
+                               video_feed_url=url_for('%s:video_feed' % type(self).__name__))
+
+    @route('/status')
+    def status(self):
+        return jsonify(self.pd.status())
+
+    @route('/metrics')
+    def metrics(self):
+        return Response(render_metrics(self.presence_detectors), mimetype='text/plain; version=0.0.4')
+
+    @route('/config')
+    def apiconfig(self):
+        return jsonify(self.pd.update_config(request.args).__dict__)
+
+    @route('/camconfig')
+    def camconfig(self):
+        cam_conf = self.pd.update_cam_config(request.args)
+        if cam_conf is not None:
+            return jsonify(cam_conf)
+
+    @route("/image")
+    def image(self):
+        encodedImage = self.pd.mjpeg.image()
+        if encodedImage is None:
+            return Response(status=503)
+        return Response(encodedImage,
+                        mimetype='image/jpeg')
+
+    @route("/events")
+    def events(self):
+        # server-sent events, e.g. /events?events=presence,thumbnail (presence, log, fps, person, thumbnail)
+        if len(self.pd.events.subscriptions) >= self.config.events_max_clients:
+            return Response(status=503)
+        return Response(self.pd.events.subscribe(event_names(request.args.get('events')), [self.pd.presence_event()]),
+                        mimetype="text/event-stream", headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @route("/history")
+    def history(self):
+        # e.g. /history?query=buckets&bucket_secs=3600, /history?query=sessions&from=2024-01-01
+        if self.pd.history is None:
+            return Response(status=404)
+        try:
+            return jsonify(self.pd.history.query(request.args))
+        except ValueError as e:
+            return Response(str(e), status=400)
+
+    @route("/video_feed")
+    def video_feed(self):
+        if self.pd.active_video_feeds >= self.config.video_feed_max_clients:
+            return Response(status=503)
+        return Response(self.pd.generate(),
+                        mimetype="multipart/x-mixed-replace; boundary=frame")
@@ -0,0 +1,32 @@
+import numpy
+
+
+class FrameRing():
+    """
+    preallocated ring of frames with a sequence counter, written by a single thread.
+    write() copies the frame into the next free slot and only then publishes its
+    sequence number, so readers get the latest completed frame from read() without
+    locking or allocating. a slot is reused after slots - 1 further writes, readers
+    which hold on to a frame should check valid(seq) once they're done with it
+    """
+
+    def __init__(self, slots=3):
+        self.slots = slots
+        self.buffers = None
+        self.seq = 0
+
+    def write(self, frame):
+        if self.buffers is None or self.buffers[0].shape != frame.shape or self.buffers[0].dtype != frame.dtype:
+            self.buffers = [numpy.empty_like(frame) for _ in range(self.slots)]
+        buffers = self.buffers
+        numpy.copyto(buffers[(self.seq + 1) % self.slots], frame)
+        self.seq += 1
+
+    def read(self):
+        seq, buffers = self.seq, self.buffers
+        if seq == 0:
+            return 0, None
+        return seq, buffers[seq % self.slots]
+
+    def valid(self, seq):
+        return self.seq - seq < self.slots - 1
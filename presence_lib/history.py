@@ -0,0 +1,284 @@
+import datetime
+import logging
+import os
+import time
+
+import numpy
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'APHIST1'
+
+# record kinds
+SAMPLE = 0
+TRANSITION = 1
+DETECTION = 2
+KINDS = ('sample', 'transition', 'detection')
+
+# person detection outcomes
+NO_DETECTION = 0
+NO_PERSON = 1
+PERSON = 2
+CACHED_PERSON = 3
+DETECTIONS = ('', 'no_person', 'person', 'cached_person')
+
+HEADER_DTYPE = numpy.dtype([('magic', 'S8'), ('record_size', '<u4'), ('capacity', '<u4'), ('count', '<u8')])
+RECORD_DTYPE = numpy.dtype([
+    ('ts', '<f8'),                # unix time
+    ('kind', 'u1'),
+    ('presence', 'i1'),
+    ('detection', 'u1'),
+    ('reserved', 'u1'),
+    ('motion_area', '<f4'),       # largest motion box since the last sample, as a fraction of the frame
+    ('argos_latency_ms', '<f4'),  # of a person detection which wasn't cached
+    ('fps', '<f4')
+])
+
+# a record's state is assumed to last until the next record, unless they're further apart
+# than this (e.g. while the service was stopped)
+MAX_GAP_SECS = 60
+
+QUERIES = ('buckets', 'sessions', 'records')
+# the default and the largest limit of the sessions and records queries
+SESSIONS_LIMIT = (100, 1000)
+RECORDS_LIMIT = (1000, 10000)
+MAX_BUCKET_SECS = 366 * 24 * 3600
+
+
+def parse_limit(args, limits):
+    default, maximum = limits
+    limit = int(args.get('limit', default))
+    if not 0 < limit <= maximum:
+        raise ValueError("limit must be between 1 and %d" % maximum)
+    return limit
+
+
+def parse_time(value):
+    # unix time or an iso 8601 date and time (local time if no offset is given)
+    try:
+        ts = float(value)
+    except ValueError:
+        ts = datetime.datetime.fromisoformat(value).timestamp()
+    # the results have dates, so anything they can't be converted to is rejected here
+    try:
+        datetime.datetime.fromtimestamp(ts)
+        datetime.datetime.fromtimestamp(ts - 24 * 3600)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError("%s is out of range" % value)
+    return ts
+
+
+class PresenceHistory():
+    """
+    an append-only log of fixed size binary records (RECORD_DTYPE) in a memory mapped
+    file of history_max_mb, where the oldest records are overwritten once it's full. a
+    sample of the presence status, motion area and fps is appended every
+    history_sample_secs, and a record for every presence transition and person
+    detection result. appending stores one record into the mapped array, so it's
+    cheap enough for the motion loop. the file is reopened after a restart and the
+    queries run vectorised numpy over a copy of its records
+    """
+
+    def __init__(self, path, max_mb, sample_secs):
+        self.path = path
+        self.sample_secs = sample_secs
+        self.capacity = max(1, int(max_mb * 1024 * 1024) // RECORD_DTYPE.itemsize)
+        self.buffer = self.open(path, self.capacity)
+        self.header = self.buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        self.records = self.buffer[HEADER_DTYPE.itemsize:].view(RECORD_DTYPE)
+        self.next_sample = 0
+        self.motion_area = 0.0
+
+    @staticmethod
+    def open(path, capacity):
+        size = HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            buffer = numpy.memmap(path, numpy.uint8, 'r+')
+            header = buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+            if header['magic'] == MAGIC and header['record_size'] == RECORD_DTYPE.itemsize \
+                    and header['capacity'] == capacity:
+                return buffer
+            del buffer
+        # a new file, or one written with another size or record layout
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        buffer = numpy.memmap(path, numpy.uint8, 'r+')
+        buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0] = (MAGIC, RECORD_DTYPE.itemsize, capacity, 0)
+        log.info("created presence history %s for %d records" % (path, capacity))
+        return buffer
+
+    @property
+    def count(self):
+        return int(self.header['count'][0])
+
+    def append(self, kind, presence, detection=NO_DETECTION, motion_area=0.0, argos_latency_ms=0.0, fps=0.0):
+        # the record is written before it's counted, so readers never see a partial one
+        count = self.count
+        self.records[count % self.capacity] = (time.time(), kind, presence, detection, 0, motion_area,
+                                               argos_latency_ms, fps)
+        self.header['count'] = count + 1
+
+    def on_frame(self, now, presence, box, frame_shape, fps):
+        if box is not None:
+            minX, minY, maxX, maxY = box[:4]
+            area = (maxX - minX) * (maxY - minY) / (frame_shape[0] * frame_shape[1])
+            if area > self.motion_area:
+                self.motion_area = area
+        if now >= self.next_sample:
+            self.next_sample = now + self.sample_secs
+            self.append(SAMPLE, presence, motion_area=self.motion_area, fps=fps)
+            self.motion_area = 0.0
+
+    def on_transition(self, presence):
+        self.append(TRANSITION, presence)
+
+    def on_detection(self, presence, person, latency_secs):
+        # cached results come without a latency
+        if latency_secs is None:
+            self.append(DETECTION, presence, CACHED_PERSON if person else NO_PERSON)
+        else:
+            self.append(DETECTION, presence, PERSON if person else NO_PERSON, argos_latency_ms=latency_secs * 1000)
+
+    def snapshot(self, start=None, end=None):
+        # a copy of the records between start and end (unix times), oldest first
+        count = self.count
+        if count <= self.capacity:
+            records = numpy.array(self.records[:count])
+        else:
+            i = count % self.capacity
+            records = numpy.concatenate((self.records[i:], self.records[:i]))
+        if start is not None:
+            records = records[records['ts'] >= start]
+        if end is not None:
+            records = records[records['ts'] < end]
+        return records
+
+    @staticmethod
+    def durations(records, end):
+        # how long each record's presence status lasted
+        ts = records['ts']
+        return numpy.clip(numpy.diff(ts, append=min(end, time.time())), 0, MAX_GAP_SECS)
+
+    def buckets(self, start, end, bucket_secs=3600):
+        # occupancy, detections and fps per bucket_secs, buckets are aligned to local time
+        records = self.snapshot(start, end)
+        if not len(records):
+            return []
+        ts = records['ts']
+        offset = time.localtime(ts[0]).tm_gmtoff
+        bucket = numpy.floor((ts + offset) / bucket_secs).astype(numpy.int64)
+        first = bucket.min()
+        index = bucket - first
+        n = int(index.max()) + 1
+
+        kind = records['kind']
+        detection = records['detection']
+        samples = kind == SAMPLE
+        calls = (kind == DETECTION) & (detection != CACHED_PERSON)
+        persons = (kind == DETECTION) & ((detection == PERSON) | (detection == CACHED_PERSON))
+        durations = self.durations(records, end)
+        occupied = numpy.bincount(index, weights=durations * (records['presence'] > 0), minlength=n)
+        covered = numpy.bincount(index, weights=durations, minlength=n)
+        transitions = numpy.bincount(index[kind == TRANSITION], minlength=n)
+        call_count = numpy.bincount(index[calls], minlength=n)
+        latency = numpy.bincount(index[calls], weights=records['argos_latency_ms'][calls], minlength=n)
+        person_count = numpy.bincount(index[persons], minlength=n)
+        sample_count = numpy.bincount(index[samples], minlength=n)
+        fps = numpy.bincount(index[samples], weights=records['fps'][samples], minlength=n)
+        motion = numpy.bincount(index[samples], weights=records['motion_area'][samples], minlength=n)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            latency_mean = latency / call_count
+            fps_mean = fps / sample_count
+            motion_mean = motion / sample_count
+
+        return [{
+            'start': datetime.datetime.fromtimestamp(int(first + i) * bucket_secs - offset),
+            'occupancy_minutes': round(float(occupied[i]) / 60, 2),
+            'recorded_minutes': round(float(covered[i]) / 60, 2),
+            'transitions': int(transitions[i]),
+            'argos_calls': int(call_count[i]),
+            'person_detections': int(person_count[i]),
+            'argos_latency_ms_mean': round(float(latency_mean[i]), 1) if call_count[i] else None,
+            'fps_mean': round(float(fps_mean[i]), 2) if sample_count[i] else None,
+            'motion_area_mean': round(float(motion_mean[i]), 4) if sample_count[i] else None
+        } for i in range(n)]
+
+    def sessions(self, start, end, limit=SESSIONS_LIMIT[0]):
+        # the latest limit presence sessions (presence on until off) with the person detections during each
+        records = self.snapshot(start, end)
+        on = records['presence'] > 0
+        if not on.any():
+            return []
+        starts = on & ~numpy.concatenate(([False], on[:-1]))
+        idx = numpy.flatnonzero(on)
+        sid = numpy.cumsum(starts)[idx] - 1
+        n = int(sid[-1]) + 1
+        first = numpy.flatnonzero(starts)
+        last = idx[numpy.append(numpy.flatnonzero(numpy.diff(sid)), len(sid) - 1)]
+        ongoing = last + 1 >= len(records)
+        # a session ends with the first record after it
+        ts = records['ts']
+        end_ts = numpy.where(ongoing, numpy.minimum(end, time.time()), ts[numpy.minimum(last + 1, len(records) - 1)])
+
+        kind = records['kind'][idx]
+        detection = records['detection'][idx]
+        calls = (kind == DETECTION) & (detection != CACHED_PERSON)
+        persons = (kind == DETECTION) & ((detection == PERSON) | (detection == CACHED_PERSON))
+        call_count = numpy.bincount(sid[calls], minlength=n)
+        latency = numpy.bincount(sid[calls], weights=records['argos_latency_ms'][idx][calls], minlength=n)
+        person_count = numpy.bincount(sid[persons], minlength=n)
+
+        return [{
+            'start': datetime.datetime.fromtimestamp(ts[first[i]]),
+            'end': datetime.datetime.fromtimestamp(end_ts[i]),
+            'duration_secs': round(float(end_ts[i] - ts[first[i]]), 1),
+            'ongoing': bool(ongoing[i]),
+            'argos_calls': int(call_count[i]),
+            'person_detections': int(person_count[i]),
+            'argos_latency_ms_mean': round(float(latency[i] / call_count[i]), 1) if call_count[i] else None
+        } for i in range(max(0, n - limit), n)]
+
+    def latest(self, start, end, limit=RECORDS_LIMIT[0]):
+        records = self.snapshot(start, end)[-limit:]
+        return [{
+            'ts': datetime.datetime.fromtimestamp(record['ts']),
+            'kind': KINDS[record['kind']],
+            'presence_status': int(record['presence']),
+            'detection': DETECTIONS[record['detection']] or None,
+            'motion_area': round(float(record['motion_area']), 4),
+            'argos_latency_ms': round(float(record['argos_latency_ms']), 1),
+            'fps': round(float(record['fps']), 2)
+        } for record in records]
+
+    def query(self, args):
+        # the /history query params, e.g. ?query=buckets&bucket_secs=3600&from=2024-01-01T00:00
+        # (from and to are unix times or iso dates, from defaults to a day ago)
+        query = args.get('query', 'buckets')
+        if query not in QUERIES:
+            raise ValueError("query must be one of %s" % ', '.join(QUERIES))
+        end = parse_time(args['to']) if args.get('to') else time.time()
+        start = parse_time(args['from']) if args.get('from') else end - 24 * 3600
+        if query == 'buckets':
+            bucket_secs = int(args.get('bucket_secs', 3600))
+            if not 0 < bucket_secs <= MAX_BUCKET_SECS:
+                raise ValueError("bucket_secs must be between 1 and %d" % MAX_BUCKET_SECS)
+            results = self.buckets(start, end, bucket_secs)
+        elif query == 'sessions':
+            results = self.sessions(start, end, parse_limit(args, SESSIONS_LIMIT))
+        else:
+            results = self.latest(start, end, parse_limit(args, RECORDS_LIMIT))
+        return {'query': query, 'from': datetime.datetime.fromtimestamp(start),
+                'to': datetime.datetime.fromtimestamp(end), 'results': results}
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'records': min(self.count, self.capacity),
+            'capacity': self.capacity,
+            'appended': self.count
+        }
+
+    def close(self):
+        # the mapped pages are written back by the OS, also after the process is killed
+        self.buffer.flush()
@@ -0,0 +1,74 @@
+def _labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in labels.items())
+
+
+class MetricsWriter():
+    # writes metrics in the prometheus text exposition format
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, metric_type, help, samples):
+        self.lines.append('# HELP %s %s' % (name, help))
+        self.lines.append('# TYPE %s %s' % (name, metric_type))
+        for suffix, labels, value in samples:
+            self.lines.append('%s%s%s %s' % (name, suffix, _labels(labels), value))
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def render_metrics(presence_detectors):
+    """
+    renders the counters and stage timings the presence detectors already keep,
+    so that exposing them costs nothing on the frame path
+    """
+    w = MetricsWriter()
+    snapshots = [pd.metrics_snapshot() for pd in presence_detectors]
+
+    stage_samples = []
+    for m in snapshots:
+        for stage, (total, count) in m['stages'].items():
+            stage_samples.append(('_sum', {'cam': m['cam'], 'stage': stage}, round(total, 6)))
+            stage_samples.append(('_count', {'cam': m['cam'], 'stage': stage}, count))
+    w.metric('argos_presence_stage_seconds', 'summary',
+             'time spent in each stage of the frame pipeline (and in detection and notification calls)',
+             stage_samples)
+
+    w.metric('argos_presence_fps', 'gauge', 'motion detection frames per second',
+             [('', {'cam': m['cam']}, round(m['fps'], 2)) for m in snapshots if m['fps'] is not None])
+    w.metric('argos_presence_status', 'gauge', 'current presence status',
+             [('', {'cam': m['cam']}, m['presence_status']) for m in snapshots])
+    w.metric('argos_presence_zone_status', 'gauge', 'current presence status of each zone',
+             [('', {'cam': m['cam'], 'zone': zone}, status) for m in snapshots for zone, status in m['zones'].items()])
+    w.metric('argos_presence_transitions_total', 'counter', 'presence status transitions',
+             [('', {'cam': m['cam'], 'to': status}, count) for m in snapshots
+              for status, count in sorted(m['transitions'].items())])
+    w.metric('argos_presence_detections_dropped_total', 'counter', 'stale person detection results dropped',
+             [('', {'cam': m['cam']}, m['detections_dropped']) for m in snapshots])
+
+    w.metric('argos_presence_detection_cache_total', 'counter', 'person detection result cache lookups',
+             [('', {'cam': m['cam'], 'result': result}, count) for m in snapshots
+              for result, count in m['detection_cache'].items()])
+
+    w.metric('argos_presence_startup_seconds', 'gauge', 'time from the process start to each startup milestone',
+             [('', {'cam': m['cam'], 'milestone': milestone}, secs) for m in snapshots
+              for milestone, secs in m['startup'].items()])
+
+    # argos clients may be shared between cameras
+    clients = {}
+    for pd in presence_detectors:
+        if pd.argos_client is not None:
+            clients.setdefault(id(pd.argos_client), (pd.config.argos_service_api_url, pd.argos_client))
+    requests_samples = []
+    latency_samples = []
+    for url, client in clients.values():
+        stats = client.stats()
+        requests_samples.append(('', {'url': url, 'outcome': 'success'}, stats['calls'] - stats['failures']))
+        requests_samples.append(('', {'url': url, 'outcome': 'failure'}, stats['failures']))
+        requests_samples.append(('', {'url': url, 'outcome': 'skipped'}, stats['skipped']))
+        latency_samples.append(('_sum', {'url': url}, stats['total_latency_secs']))
+        latency_samples.append(('_count', {'url': url}, stats['calls']))
+    w.metric('argos_presence_argos_requests_total', 'counter', 'argos service requests by outcome', requests_samples)
+    w.metric('argos_presence_argos_request_seconds', 'summary', 'argos service request latency', latency_samples)
+
+    return w.render()
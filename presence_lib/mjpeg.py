@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+import cv2
+
+from presence_lib.frame_ring import FrameRing
+
+log = logging.getLogger(__name__)
+
+
+class MjpegBroadcaster():
+    """
+    encodes each new output frame at most once, on a single thread, and fans the
+    jpeg out to all subscribers. slow subscribers simply skip frames. nothing is
+    encoded while there are no subscribers and /image hasn't been asked for recently
+    """
+
+    def __init__(self, frame_rate_fn, idle_secs, profiler=None, ring_slots=3):
+        self.frame_rate_fn = frame_rate_fn
+        self.profiler = profiler
+        self.idle_secs = idle_secs
+        self.frames = FrameRing(ring_slots)
+        self.jpeg = None
+        self.jpeg_seq = 0
+        self.jpeg_frame_seq = 0
+        self.subscribers = 0
+        self.last_image_request = 0
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.encode, name='mjpeg-encoder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def wanted(self):
+        return self.subscribers > 0 or time.monotonic() - self.last_image_request < self.idle_secs
+
+    @property
+    def frame_seq(self):
+        return self.frames.seq
+
+    def publish(self, frame):
+        # the frame is copied into the ring, the caller is free to keep drawing on it
+        self.frames.write(frame)
+        with self.cond:
+            self.cond.notify_all()
+
+    def encode(self):
+        while not self.stopped:
+            with self.cond:
+                self.cond.wait_for(lambda: self.stopped or (self.frame_seq > self.jpeg_frame_seq and self.wanted()),
+                                   timeout=1)
+            frame_seq, frame = self.frames.read()
+            if self.stopped or frame is None or not self.wanted() or frame_seq <= self.jpeg_frame_seq:
+                continue
+
+            start = time.monotonic()
+            t = time.perf_counter()
+            (flag, encodedImage) = cv2.imencode(".jpg", frame)
+            if self.profiler:
+                self.profiler.record('encode', t)
+            # skip the frame if its slot got overwritten while encoding
+            if flag and self.frames.valid(frame_seq):
+                with self.cond:
+                    self.jpeg = encodedImage.tobytes()
+                    self.jpeg_seq += 1
+                    self.jpeg_frame_seq = frame_seq
+                    self.cond.notify_all()
+
+            # limit the encoding to the video feed frame rate
+            delay = 1 / self.frame_rate_fn() - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def image(self, timeout=2):
+        # returns the latest jpeg, waiting for a fresh one if the encoder was idle
+        idle = not self.wanted()
+        self.last_image_request = time.monotonic()
+        with self.cond:
+            if idle or self.jpeg is None:
+                seq = self.jpeg_seq
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: self.stopped or self.jpeg_seq > seq, timeout=timeout)
+            return self.jpeg
+
+    def subscribe(self):
+        with self.cond:
+            self.subscribers += 1
+        seq = 0
+        try:
+            while not self.stopped:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.stopped or self.jpeg_seq > seq, timeout=1)
+                    if self.jpeg_seq == seq:
+                        continue
+                    seq, jpeg = self.jpeg_seq, self.jpeg
+                yield jpeg
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+
+    def stop(self):
+        self.stopped = True
+        with self.cond:
+            self.cond.notify_all()
+        self.thread.join()
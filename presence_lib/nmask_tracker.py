@@ -0,0 +1,96 @@
+import logging
+
+import cv2
+
+log = logging.getLogger(__name__)
+
+
+class NmaskTemplateTracker():
+    """
+    tracks where the nmask templates (e.g. wall portraits which cause false person
+    detections) are in the frame. each template is searched for in a window around
+    its last location, optionally on an image downscaled by 2^pyramid_levels first,
+    and the whole frame is only searched again when the match confidence drops
+    below min_confidence
+    """
+
+    def __init__(self, template_paths, search_margin, min_confidence, pyramid_levels, padding=10):
+        self.search_margin = search_margin
+        self.min_confidence = min_confidence
+        self.scale = 2 ** pyramid_levels
+        self.padding = padding
+        self.templates = []
+        for path in template_paths:
+            template = cv2.imread(path, 0)
+            if template is None:
+                log.error("could not read argos nmask template: %s" % path)
+                continue
+            th, tw = template.shape
+            small = None
+            # the template needs to keep some detail to be matched on the downscaled image
+            if self.scale > 1 and min(th, tw) // self.scale >= 8:
+                small = cv2.resize(template, (tw // self.scale, th // self.scale), interpolation=cv2.INTER_AREA)
+            self.templates.append((template, small))
+        self.locations = [None] * len(self.templates)
+        self.confidences = [0.0] * len(self.templates)
+        self.window_searches = 0
+        self.full_searches = 0
+
+    def update(self, frame):
+        # returns the padded (minX, minY, maxX, maxY) box of every template found
+        gray = None
+        boxes = []
+        for i, (template, small) in enumerate(self.templates):
+            th, tw = template.shape
+            loc, confidence = None, 0.0
+            if self.locations[i] is not None:
+                x, y = self.locations[i]
+                x0 = max(0, x - self.search_margin)
+                y0 = max(0, y - self.search_margin)
+                window = frame[y0:y + th + self.search_margin, x0:x + tw + self.search_margin]
+                loc, confidence = self._match(cv2.cvtColor(window, cv2.COLOR_BGR2GRAY), template, small)
+                if loc is not None:
+                    loc = (x0 + loc[0], y0 + loc[1])
+                self.window_searches += 1
+            if loc is None or confidence < self.min_confidence:
+                if gray is None:
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                loc, confidence = self._match(gray, template, small)
+                self.full_searches += 1
+
+            self.confidences[i] = confidence
+            if loc is None:
+                continue
+            self.locations[i] = loc
+            boxes.append((loc[0] - self.padding, loc[1] - self.padding,
+                          loc[0] + tw + self.padding, loc[1] + th + self.padding))
+        return boxes
+
+    def _match(self, img, template, small):
+        th, tw = template.shape
+        if img.shape[0] < th or img.shape[1] < tw:
+            return None, 0.0
+        if small is not None:
+            # coarse search on the downscaled image, refined at full resolution around the match
+            img_small = cv2.resize(img, (img.shape[1] // self.scale, img.shape[0] // self.scale),
+                                   interpolation=cv2.INTER_AREA)
+            if img_small.shape[0] >= small.shape[0] and img_small.shape[1] >= small.shape[1]:
+                res = cv2.matchTemplate(img_small, small, cv2.TM_CCOEFF_NORMED)
+                min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+                x0 = max(0, max_loc[0] * self.scale - self.scale)
+                y0 = max(0, max_loc[1] * self.scale - self.scale)
+                window = img[y0:y0 + th + 2 * self.scale, x0:x0 + tw + 2 * self.scale]
+                loc, confidence = self._match(window, template, None)
+                if loc is not None:
+                    return (x0 + loc[0], y0 + loc[1]), confidence
+                return None, 0.0
+        res = cv2.matchTemplate(img, template, cv2.TM_CCOEFF_NORMED)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        return max_loc, max_val
+
+    def stats(self):
+        return {
+            'confidences': [round(float(c), 3) for c in self.confidences],
+            'window_searches': self.window_searches,
+            'full_searches': self.full_searches
+        }
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class OutboxSink():
+    def __init__(self, name, send_fn, enabled_fn, heartbeat, key, state, now):
+        self.name = name
+        self.key = key
+        self.send_fn = send_fn
+        self.enabled_fn = enabled_fn
+        self.heartbeat = heartbeat
+        self.delivered = state
+        self.last_sent = now
+        # heartbeats don't count towards the coalesce window, the first change after a quiet
+        # period goes out at once
+        self.last_change_sent = 0
+        self.next_attempt = 0
+        self.retry_secs = 0
+        self.sent = 0
+        self.failures = 0
+
+
+class NotificationOutbox():
+    """
+    delivers presence state notifications (mqtt, HA webhook) on a background thread
+    so that a slow receiver never costs frames. each sink gets at most one state
+    change per coalesce_secs, so rapid on/off flaps collapse into the latest state,
+    failed sends are retried with exponential backoff and heartbeat sinks get the
+    current state re-sent every heartbeat_secs. sinks may follow a state of their
+    own, e.g. a zone's, which is posted under their key
+    """
+
+    def __init__(self, config, state, profiler=None):
+        self.config = config
+        self.profiler = profiler
+        self.states = {None: state}
+        self.sinks = []
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='notification-outbox')
+        self.thread.daemon = True
+
+    def add_sink(self, name, send_fn, enabled_fn, heartbeat=False, key=None, state=0):
+        # state is the one the receiver is assumed to have, a sink added while the outbox
+        # is running is sent the current state if it changed since
+        with self.cond:
+            self.states.setdefault(key, state)
+            self.sinks.append(OutboxSink(name, send_fn, enabled_fn, heartbeat, key, state, time.monotonic()))
+            self.cond.notify()
+
+    def start(self):
+        self.thread.start()
+
+    def post(self, state, key=None):
+        with self.cond:
+            self.states[key] = state
+            self.cond.notify()
+
+    def due_in(self, sink, now):
+        if not sink.enabled_fn():
+            return None
+        if sink.delivered != self.states[sink.key]:
+            return max(sink.next_attempt, sink.last_change_sent + self.config.notify_coalesce_secs) - now
+        if sink.heartbeat:
+            return max(sink.next_attempt, sink.last_sent + self.config.mqtt_heartbeat_secs) - now
+        return None
+
+    def run(self):
+        while not self.stopped:
+            now = time.monotonic()
+            wait = 1
+            for sink in self.sinks:
+                due_in = self.due_in(sink, now)
+                if due_in is None:
+                    continue
+                if due_in <= 0:
+                    self.deliver(sink, self.states[sink.key])
+                    due_in = self.due_in(sink, time.monotonic())
+                if due_in is not None:
+                    wait = min(wait, max(due_in, 0))
+            with self.cond:
+                if not self.stopped:
+                    self.cond.wait(timeout=wait)
+
+    def deliver(self, sink, state):
+        t = time.perf_counter()
+        try:
+            sink.send_fn(state)
+        except Exception as e:
+            sink.failures += 1
+            sink.retry_secs = min(max(sink.retry_secs * 2, self.config.notify_retry_secs),
+                                  self.config.notify_max_retry_secs)
+            sink.next_attempt = time.monotonic() + sink.retry_secs
+            log.error("could not send presence %s notification, retrying in %.1fs: %s" % (
+                sink.name, sink.retry_secs, str(e)))
+        else:
+            if state != sink.delivered:
+                sink.last_change_sent = time.monotonic()
+            sink.delivered = state
+            sink.last_sent = time.monotonic()
+            sink.retry_secs = 0
+            sink.next_attempt = 0
+            sink.sent += 1
+        if self.profiler:
+            self.profiler.record(sink.name, t)
+
+    def stats(self):
+        return {sink.name: {'sent': sink.sent, 'failures': sink.failures,
+                            'pending': sink.delivered != self.states[sink.key]} for sink in self.sinks}
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        if self.thread.is_alive():
+            self.thread.join()
@@ -0,0 +1,54 @@
+WARMUP = 'warmup'
+COOLDOWN = 'cooldown'
+
+
+class PresenceStateMachine():
+    """
+    the warmUp/coolDown presence state machine, fed with motion and person
+    detection events and monotonic timestamps. the event methods return whether
+    the presence status changed and, for motion events, which kind of person
+    detection (if any) should verify the current state
+    """
+
+    def __init__(self, config, now):
+        self.config = config
+        self.status = 0
+        self.last_motion = now
+        self.last_nonmotion = now
+
+    def in_warmup(self, now):
+        return self.status == 0 and now - self.last_nonmotion <= self.config.presence_warmup_secs
+
+    def active(self, now, motion):
+        return self.status == 1 or motion or self.in_warmup(now)
+
+    def on_motion(self, now):
+        changed, detect = False, None
+        if self.status == 0:
+            if self.in_warmup(now):
+                # motion right after presence went off (e.g. lights turning off)
+                # only turns presence on if a person is detected
+                detect = WARMUP
+            else:
+                self.status = 1
+                changed = True
+        self.last_motion = now
+        return changed, detect
+
+    def on_no_motion(self, now):
+        if self.status == 1:
+            if now - self.last_motion > self.config.presence_cooldown_secs:
+                self.status = 0
+                self.last_nonmotion = now
+                return True, None
+            # keep extending the coolDown for as long as a person is detected
+            return False, COOLDOWN
+        return False, None
+
+    def on_person(self, kind, now):
+        if kind == WARMUP and self.status == 0:
+            self.status = 1
+            return True
+        if kind == COOLDOWN and self.status == 1:
+            self.last_motion = now
+        return False
@@ -0,0 +1,43 @@
+import collections
+import time
+
+import numpy
+
+
+class StageProfiler():
+    """
+    accumulates the time spent in each stage of the frame pipeline. individual
+    samples (for percentiles) are only kept when keep_samples is set, e.g. by the
+    benchmark, so that it can be left on in production
+    """
+
+    def __init__(self, keep_samples=False):
+        self.counts = collections.defaultdict(int)
+        self.totals = collections.defaultdict(float)
+        self.samples = collections.defaultdict(list) if keep_samples else None
+
+    def record(self, stage, start):
+        # records the time since start (a time.perf_counter()) and returns the current time
+        now = time.perf_counter()
+        elapsed = now - start
+        self.counts[stage] += 1
+        self.totals[stage] += elapsed
+        if self.samples is not None:
+            self.samples[stage].append(elapsed)
+        return now
+
+    def summary(self):
+        summary = {}
+        for stage in list(self.counts):
+            count = self.counts[stage]
+            stats = {
+                'count': count,
+                'total_ms': round(self.totals[stage] * 1000, 2),
+                'avg_ms': round(self.totals[stage] * 1000 / count, 3)
+            }
+            if self.samples is not None and self.samples[stage]:
+                p50, p99 = numpy.percentile(self.samples[stage], [50, 99])
+                stats['p50_ms'] = round(p50 * 1000, 3)
+                stats['p99_ms'] = round(p99 * 1000, 3)
+            summary[stage] = stats
+        return summary
@@ -0,0 +1,209 @@
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from presence_lib.frame_ring import FrameRing
+
+log = logging.getLogger(__name__)
+
+# only files with these prefixes count towards (and are deleted by) the retention limits
+SNAPSHOT_PREFIX = 'motion_frame_'
+CLIP_PREFIX = 'presence_clip_'
+
+# how often the writer thread checks for stop when clips are disabled
+POLL_SECS = 1
+
+
+class Clip():
+    def __init__(self, name, frames, end):
+        self.name = name
+        self.frames = list(frames)
+        self.end = end
+
+
+class MotionRecorder():
+    """
+    writes motion snapshots and presence clips under md_first_frame_write_path on a
+    background thread, so the motion loop never waits on the disk. snapshots are
+    dropped when the write queue is full. for clips, output frames are sampled at
+    md_clip_fps into a frame ring and jpeg encoded on the writer thread into an
+    in-memory ring of the last md_clip_pre_secs. a clip starts with that ring and
+    ends md_clip_post_secs after the last presence transition, it's saved as a
+    .mjpeg file (concatenated jpegs, plays in ffplay or vlc). clips are of the output
+    video, so output_frame_enabled = False turns them off too. after every write the
+    oldest files are deleted until the folder is within md_first_frame_write_max_mb
+    and md_first_frame_write_max_files. the writer thread only starts once snapshots
+    or clips are enabled
+    """
+
+    def __init__(self, config, profiler=None):
+        if (config.md_clip_pre_secs > 0 or config.md_clip_post_secs > 0) and config.md_clip_fps <= 0:
+            raise ValueError("md_clip_fps must be positive when clips are enabled")
+        self.config = config
+        self.profiler = profiler
+        self.path = config.md_first_frame_write_path
+        self.requests = queue.Queue(maxsize=8)
+        self.frames = FrameRing(3)
+        self.last_frame = 0
+        self.encoded_seq = 0
+        self.recent = collections.deque()
+        self.clip = None
+        self.files = collections.deque()
+        self.bytes = 0
+        self.written = 0
+        self.dropped = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='motion-recorder')
+        self.thread.daemon = True
+
+    @property
+    def clips_enabled(self):
+        # a config reloaded with md_clip_fps = 0 turns clips off
+        return (self.config.md_clip_pre_secs > 0 or self.config.md_clip_post_secs > 0) and \
+            self.config.md_clip_fps > 0 and self.config.output_frame_enabled
+
+    def start(self):
+        # called again when the config changes
+        if not self.thread.ident and (self.config.md_first_frame_write or self.clips_enabled):
+            self.thread.start()
+        return self
+
+    def request(self, item):
+        try:
+            self.requests.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def snapshot(self, frame, name):
+        # the frame is copied, the caller is free to keep drawing on it
+        self.request(('snapshot', name, frame.copy()))
+
+    def transition(self, name):
+        if self.clips_enabled:
+            self.request(('clip', name, None))
+
+    def add_frame(self, frame):
+        # called for every output frame, keeps one every 1 / md_clip_fps seconds
+        now = time.monotonic()
+        if self.clips_enabled and now - self.last_frame >= 1 / self.config.md_clip_fps:
+            self.last_frame = now
+            self.frames.write(frame)
+
+    def run(self):
+        self.scan()
+        while not self.stopped:
+            # clip frames are encoded between requests
+            timeout = 1 / self.config.md_clip_fps if self.clips_enabled else POLL_SECS
+            try:
+                kind, name, frame = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            else:
+                if kind == 'snapshot':
+                    self.write_snapshot(name, frame)
+                elif kind == 'clip':
+                    self.start_clip(name)
+            if self.clips_enabled:
+                self.encode_frame()
+            if self.clip and (time.monotonic() >= self.clip.end or
+                              len(self.clip.frames) >= self.config.md_clip_max_secs * self.config.md_clip_fps):
+                self.write_clip()
+
+    def encode_frame(self):
+        seq, frame = self.frames.read()
+        if frame is None or seq == self.encoded_seq:
+            return
+        t = time.perf_counter()
+        flag, jpeg = cv2.imencode('.jpg', frame)
+        if not flag or not self.frames.valid(seq):
+            return
+        self.encoded_seq = seq
+        now = time.monotonic()
+        jpeg = jpeg.tobytes()
+        self.recent.append((now, jpeg))
+        while self.recent and now - self.recent[0][0] > self.config.md_clip_pre_secs:
+            self.recent.popleft()
+        if self.clip:
+            self.clip.frames.append(jpeg)
+        if self.profiler:
+            self.profiler.record('clip_encode', t)
+
+    def start_clip(self, name):
+        end = time.monotonic() + self.config.md_clip_post_secs
+        if self.clip:
+            # transitions while a clip is recording extend it
+            self.clip.end = end
+        else:
+            self.clip = Clip(name, (jpeg for ts, jpeg in self.recent), end)
+
+    def write_snapshot(self, name, frame):
+        flag, jpeg = cv2.imencode('.jpg', frame)
+        if flag:
+            self.write('%s%s.jpg' % (SNAPSHOT_PREFIX, name), jpeg.tobytes())
+
+    def write_clip(self):
+        clip, self.clip = self.clip, None
+        if clip.frames:
+            self.write('%s%s.mjpeg' % (CLIP_PREFIX, clip.name), b''.join(clip.frames))
+
+    def write(self, filename, data):
+        t = time.perf_counter()
+        path = os.path.join(self.path, filename)
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            log.error("could not write %s: %s" % (path, str(e)))
+            return
+        self.files.append((path, len(data)))
+        self.bytes += len(data)
+        self.written += 1
+        self.prune()
+        if self.profiler:
+            self.profiler.record('record_write', t)
+
+    def scan(self):
+        # picks up the files written by earlier runs, oldest first
+        if not os.path.isdir(self.path):
+            return
+        try:
+            entries = [entry for entry in os.scandir(self.path) if entry.is_file() and
+                       entry.name.startswith((SNAPSHOT_PREFIX, CLIP_PREFIX))]
+        except OSError as e:
+            log.error("could not list %s: %s" % (self.path, str(e)))
+            return
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self.files.append((entry.path, entry.stat().st_size))
+            self.bytes += entry.stat().st_size
+        self.prune()
+
+    def prune(self):
+        max_bytes = self.config.md_first_frame_write_max_mb * 1024 * 1024
+        while self.files and (self.bytes > max_bytes or len(self.files) > self.config.md_first_frame_write_max_files):
+            path, size = self.files.popleft()
+            self.bytes -= size
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.warning("could not delete %s: %s" % (path, str(e)))
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'files': len(self.files),
+            'megabytes': round(self.bytes / 1024 / 1024, 1),
+            'recording_clip': self.clip is not None
+        }
+
+    def stop(self):
+        self.stopped = True
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.clip:
+            self.write_clip()
@@ -0,0 +1,35 @@
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class AdaptiveScheduler():
+    """
+    lowers the motion detection rate to md_idle_fps once there has been no activity
+    (motion, warmUp or coolDown) for md_idle_after_secs, and goes back to full rate
+    as soon as there is
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.last_activity = time.monotonic()
+        self.last_frame = 0
+        self.idle = False
+
+    def wait(self, active):
+        # called once per frame before reading it, sleeps to keep the idle rate
+        now = time.monotonic()
+        if active:
+            self.last_activity = now
+        idle = self.config.md_idle_fps > 0 and now - self.last_activity > self.config.md_idle_after_secs
+        if idle != self.idle:
+            self.idle = idle
+            log.info("motion detection %s" % ("idle: %s fps" % self.config.md_idle_fps if idle else "at full rate"))
+
+        if idle:
+            delay = 1 / self.config.md_idle_fps - (now - self.last_frame)
+            if delay > 0:
+                time.sleep(delay)
+                now = time.monotonic()
+        self.last_frame = now
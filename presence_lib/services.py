@@ -0,0 +1,54 @@
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class SharedServices():
+    """
+    clients which are shared by all the presence detectors running in one process:
+    one mqtt connection per broker and one argos client per argos service url. it also
+    makes each detector's event bus, which a camera process forwards to the main process
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mqtt_clients = {}
+        self.argos_clients = {}
+
+    def event_bus(self, config):
+        from presence_lib.events import EventBus
+
+        return EventBus(config.events_queue_size, config.events_keepalive_secs)
+
+    def mqtt(self, config):
+        from lib.ha_mqtt import HaMQTT
+
+        key = (config.mqtt_host, config.mqtt_port, config.mqtt_username)
+        with self.lock:
+            if key not in self.mqtt_clients:
+                self.mqtt_clients[key] = HaMQTT(config.mqtt_host, config.mqtt_port,
+                                                config.mqtt_username, config.mqtt_password)
+            return self.mqtt_clients[key]
+
+    def argos_client(self, config):
+        from presence_lib.argos_client import ArgosClient
+        from presence_lib.batching import BatchingArgosClient
+
+        key = config.argos_service_api_url
+        with self.lock:
+            client = self.argos_clients.get(key)
+            if client is None:
+                client = ArgosClient(config, config.argos_detection_max_inflight)
+                if config.argos_service_batch_api_url:
+                    client = BatchingArgosClient(client, config.argos_detection_batch_window_ms / 1000,
+                                                 config.argos_detection_batch_max_size)
+                self.argos_clients[key] = client
+            else:
+                # every detector sharing the client may have its detections in flight at once
+                client.resize_pool(client.pool_size + config.argos_detection_max_inflight)
+            return client
+
+    def close(self):
+        for client in self.argos_clients.values():
+            client.close()
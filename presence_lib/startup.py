@@ -0,0 +1,50 @@
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+
+def process_times():
+    # (seconds since this process started, seconds from boot to its start) from /proc,
+    # (None, None) where there is no /proc
+    try:
+        with open('/proc/self/stat') as f:
+            # the fields after the command name, starttime is field 22
+            started = int(f.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None, None
+    return uptime - started, started
+
+
+class StartupTimer():
+    """
+    the time from the start of the process to each startup milestone (imports done,
+    capture started, first frame, first presence event, ...), each one logged when it's
+    first reached. the process start is read from /proc so that the interpreter start
+    counts too, and the time from boot to the process start is kept, which tells a
+    reboot from a container restart
+    """
+
+    def __init__(self, fallback_start=None):
+        age, self.boot_to_start_secs = process_times()
+        if age is not None:
+            self.start = time.monotonic() - age
+        else:
+            self.start = fallback_start if fallback_start is not None else time.monotonic()
+        self.milestones = {}
+
+    def mark(self, milestone, now=None):
+        if milestone in self.milestones:
+            return
+        secs = (now if now is not None else time.monotonic()) - self.start
+        self.milestones[milestone] = round(secs, 3)
+        log.info("startup: %s after %.2fs" % (milestone, secs))
+
+    def stats(self):
+        return {
+            'milestones_secs': dict(self.milestones),
+            'boot_to_start_secs': round(self.boot_to_start_secs, 1) if self.boot_to_start_secs is not None else None
+        }
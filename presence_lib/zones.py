@@ -0,0 +1,83 @@
+import cv2
+import numpy
+
+from presence_lib.presence_state import COOLDOWN, WARMUP, PresenceStateMachine
+
+
+class MotionZones():
+    """
+    motion and presence for the named zones of md_zones, all computed in one pass per
+    frame however many zones there are: the frame is downscaled to md_zone_frame_width
+    and compared to a running average background, a label image maps every pixel to
+    its zone and np.bincount counts the foreground pixels of all zones at once. a zone
+    has motion when at least md_zone_min_area of it is foreground. each zone has its
+    own warmUp/coolDown state machine, person detections count for the zones they overlap
+    """
+
+    def __init__(self, config, now):
+        self.config = config
+        self.names = list(config.md_zones)
+        self.boxes = [config.md_zones[name] for name in self.names]
+        self.states = {name: PresenceStateMachine(config, now) for name in self.names}
+        self.motion = numpy.zeros(len(self.names) + 1)
+        self.labels = None
+        self.sizes = None
+        self.size = None
+        self.frame_shape = None
+        self.background = None
+
+    def build_labels(self, frame_shape):
+        # later zones win where zones overlap
+        height, width = frame_shape[:2]
+        scale = min(1.0, self.config.md_zone_frame_width / width)
+        self.size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        self.labels = numpy.zeros((self.size[1], self.size[0]), numpy.uint8)
+        for label, (minX, minY, maxX, maxY) in enumerate(self.boxes, 1):
+            self.labels[max(0, round(minY * scale)):round(maxY * scale),
+                        max(0, round(minX * scale)):round(maxX * scale)] = label
+        self.sizes = numpy.maximum(numpy.bincount(self.labels.ravel(), minlength=len(self.boxes) + 1), 1)
+        self.background = None
+
+    def update(self, frame, now):
+        # returns the (zone, presence status) of the zones whose presence changed, and whether
+        # a zone in warmUp has motion which a person detection should verify
+        if self.frame_shape != frame.shape[:2]:
+            self.frame_shape = frame.shape[:2]
+            self.build_labels(frame.shape)
+        gray = cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if self.background is None:
+            self.background = gray.astype(numpy.float32)
+            return [], False
+        foreground = cv2.absdiff(gray, cv2.convertScaleAbs(self.background)) > self.config.md_tval
+        cv2.accumulateWeighted(gray, self.background, self.config.md_bg_accum_weight)
+        self.motion = numpy.bincount(self.labels[foreground], minlength=len(self.boxes) + 1) / self.sizes
+
+        changed = []
+        verify = False
+        for label, name in enumerate(self.names, 1):
+            state = self.states[name]
+            if self.motion[label] >= self.config.md_zone_min_area:
+                zone_changed, detect = state.on_motion(now)
+                verify = verify or detect == WARMUP
+            else:
+                zone_changed, _ = state.on_no_motion(now)
+            if zone_changed:
+                changed.append((name, state.status))
+        return changed, verify
+
+    def on_person(self, box, now):
+        # a person (box in frame coordinates) turns on the zones it overlaps, or extends
+        # their coolDown if they are on
+        changed = []
+        minx, miny, maxx, maxy = box[:4]
+        for name, (minX, minY, maxX, maxY) in zip(self.names, self.boxes):
+            if minx >= maxX or maxx <= minX or miny >= maxY or maxy <= minY:
+                continue
+            state = self.states[name]
+            if state.on_person(WARMUP if state.status == 0 else COOLDOWN, now):
+                changed.append((name, state.status))
+        return changed
+
+    def stats(self):
+        return {name: {'presence_status': self.states[name].status, 'motion': round(float(self.motion[label]), 3)}
+                for label, name in enumerate(self.names, 1)}